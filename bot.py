@@ -1,12 +1,22 @@
 import os
+import socket
 import logging
 import random
 import math
 import asyncio
-from datetime import datetime
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from dotenv import load_dotenv
 from typing import Union
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import ObjectId
+from bson.int64 import Int64
 from telegram import (
     Update, 
     InlineKeyboardMarkup, 
@@ -15,17 +25,23 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     ContextTypes,
     CallbackQueryHandler,
+    ChatMemberHandler,
+    TypeHandler,
     filters,
 )
-from telegram.error import BadRequest, RetryAfter
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 from aiohttp import web
 from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageFilter
 import io
-import re
+import hashlib
+import hmac
+import json
+import signal
 
 # Load environment variables
 load_dotenv()
@@ -54,29 +70,115 @@ CONFIG = {
 CHANNEL_USERNAMES = os.getenv("CHANNEL_USERNAMES", "@megahubbots, @Freenethubz, @smmserviceslogs").split(",")
 CHANNEL_LINKS = os.getenv("CHANNEL_LINKS", "https://t.me/megahubbots, https://t.me/Freenethubz, https://t.me/smmserviceslogs").split(",")
 
-# MongoDB connection
-client = MongoClient(os.getenv('MONGODB_URI'))
+# Membership cache configuration (seconds / entries)
+MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL', 600))
+MEMBERSHIP_NEGATIVE_TTL = int(os.getenv('MEMBERSHIP_NEGATIVE_TTL', 5))
+MEMBERSHIP_INDEX_REFRESH = int(os.getenv('MEMBERSHIP_INDEX_REFRESH', 60))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', 50000))
+
+# Users whose profile was recently written, so repeat /starts can skip add_user's write
+RECENT_USERS_CACHE_SIZE = int(os.getenv('RECENT_USERS_CACHE_SIZE', 50000))
+RECENT_USERS_TTL = int(os.getenv('RECENT_USERS_TTL', 3600))
+
+# MongoDB connection (async driver so handlers yield to the event loop while waiting on Mongo)
+client = AsyncMongoClient(os.getenv('MONGODB_URI'))
 db = client[os.getenv('DATABASE_NAME', 'AirtimePrankBot')]
 
 # Collections
 users_collection = db['users']
 leaderboard_collection = db['leaderboard']
 admins_collection = db['admins']
-
-# Initialize database with admin user if empty
-if admins_collection.count_documents({}) == 0 and os.getenv('ADMIN_IDS'):
-    for admin_id in CONFIG['admin_ids']:
-        admins_collection.update_one(
-            {'user_id': admin_id},
-            {'$set': {'user_id': admin_id}},
-            upsert=True
-        )
+memberships_collection = db['memberships']
+jobs_collection = db['jobs']
+leaderboard_buckets_collection = db['leaderboard_buckets']
+counters_collection = db['counters']
+activity_collection = db['activity']
+media_collection = db['media']
+settings_collection = db['settings']
+
+# Single document holding the /stats counters
+STATS_COUNTERS_ID = 'stats'
+
+async def init_admins():
+    """Initialize database with admin user if empty"""
+    if await admins_collection.count_documents({}) == 0 and os.getenv('ADMIN_IDS'):
+        for admin_id in CONFIG['admin_ids']:
+            await admins_collection.update_one(
+                {'user_id': admin_id},
+                {'$set': {'user_id': admin_id}},
+                upsert=True
+            )
 
 # Webhook configuration
 PORT = int(os.getenv('PORT', 10000))
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', '') + WEBHOOK_PATH
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_DEDUPE_SIZE = int(os.getenv('WEBHOOK_DEDUPE_SIZE', 10000))  # recent update_ids remembered
+
+# Update processing: how many updates run at once across all users
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 64))
+
+# Seconds between admin list reloads when change streams aren't available
+ADMIN_REFRESH_INTERVAL = float(os.getenv('ADMIN_REFRESH_INTERVAL', 60))
+
+# Broadcast configuration
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 20))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))  # Telegram allows ~30 messages/second per bot
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 500))  # users per broadcast chunk job
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', 3))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 10))
+
+# Leaderboard configuration. The TTL only matters with several instances,
+# where another instance's writes can't invalidate our cache.
+LEADERBOARD_SIZE = 10
+LEADERBOARD_CACHE_TTL = int(os.getenv('LEADERBOARD_CACHE_TTL', 60))
+
+# Optional write-behind buffering of airtime transactions
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_INTERVAL_MS', 250))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 500))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', 5000))
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', 30))
+WRITE_BEHIND_SHUTDOWN_GRACE = float(os.getenv('WRITE_BEHIND_SHUTDOWN_GRACE', 15))
+# Batch ids remembered per document; batches are applied in order, so only the latest few matter
+APPLIED_BATCHES_KEPT = 20
+
+# Activity tracking configuration
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 30))
+ACTIVITY_INDEX_CACHE_SIZE = int(os.getenv('ACTIVITY_INDEX_CACHE_SIZE', 100000))
+ACTIVITY_RETENTION_DAYS = 35
+
+# Time-windowed leaderboards, served from per-period bucket counters
+LEADERBOARD_PERIODS = {
+    'daily': "Tᴏᴅᴀʏ",
+    'weekly': "Tʜɪꜱ Wᴇᴇᴋ",
+    'monthly': "Tʜɪꜱ Mᴏɴᴛʜ",
+}
+LEADERBOARD_BOARDS = {'all': "Aʟʟ Tɪᴍᴇ", **LEADERBOARD_PERIODS}
+
+# Transfer animation configuration
+ANIMATION_MAX_CALLS = int(os.getenv('ANIMATION_MAX_CALLS', 8))  # edits per animation
+ANIMATION_DURATION = float(os.getenv('ANIMATION_DURATION', 6))  # seconds
+ANIMATION_CHAT_INTERVAL = float(os.getenv('ANIMATION_CHAT_INTERVAL', 1))  # min seconds between edits in one chat
+ANIMATION_GLOBAL_RATE = float(os.getenv('ANIMATION_GLOBAL_RATE', 20))  # edits per second across all chats
+ANIMATION_TRACKED_CHATS = int(os.getenv('ANIMATION_TRACKED_CHATS', 10000))
+
+# Admission control defaults; admins can change them at runtime with /limits
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', 3))  # airtime flows per minute per user
+ADMISSION_USER_BURST = int(os.getenv('ADMISSION_USER_BURST', 2))
+ADMISSION_MAX_ANIMATIONS = int(os.getenv('ADMISSION_MAX_ANIMATIONS', 50))  # in-flight animations, all users
+ADMISSION_TRACKED_USERS = int(os.getenv('ADMISSION_TRACKED_USERS', 10000))
+ADMISSION_SETTINGS_ID = 'admission'
+
+# Job queue configuration
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_SHUTDOWN_GRACE = float(os.getenv('JOB_SHUTDOWN_GRACE', 10))
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
 
 # Welcome message
 WELCOME_MESSAGE = """
@@ -110,6 +212,54 @@ COUNTRIES = {
     "RW": "Rwanda 🇷🇼"
 }
 
+# Country calling code -> (country, {network: operator prefixes after the
+# country code and any leading zeros}). Matched longest prefix first.
+PHONE_PREFIXES = {
+    "256": ("Uganda 🇺🇬", {
+        "Airtel": ["75", "70", "74", "20"],
+        "MTN": ["77", "78", "39"],
+        "Africell": ["79"],
+        "Uganda Telecom": ["71", "41"],
+        "Vodafone": ["72"],
+    }),
+    "254": ("Kenya 🇰🇪", {
+        "Safaricom": ["7"],
+        "Airtel": ["10", "11"],
+        "Telkom": ["20"],
+    }),
+    "255": ("Tanzania 🇹🇿", {
+        "Airtel": ["65", "68"],
+        "Vodacom": ["75", "76"],
+        "Tigo": ["71"],
+    }),
+    "250": ("Rwanda 🇷🇼", {
+        "MTN": ["78", "79"],
+        "Airtel": ["72"],
+    }),
+    "251": ("Ethiopia 🇪🇹", {
+        "Ethio Telecom": ["91", "90", "96"],
+    }),
+    "234": ("Nigeria 🇳🇬", {
+        "MTN or Glo or Airtel or 9mobile (check exact prefix)": [f"70{d}" for d in range(1, 10)],
+        "MTN or Glo or Airtel (legacy numbers)": [f"80{d}" for d in range(2, 10)],
+    }),
+    "233": ("Ghana 🇬🇭", {
+        "MTN": ["24", "54", "55"],
+        "Vodafone": ["20", "50"],
+        "AirtelTigo": ["26", "56"],
+    }),
+    "263": ("Zimbabwe 🇿🇼", {
+        "Econet": ["71"],
+        "Telecel": ["73"],
+        "NetOne": ["77"],
+    }),
+    "223": ("Mali 🇲🇱", {
+        "Orange Mali": ["7"],
+        "Malitel": ["6"],
+    }),
+}
+PHONE_LOOKUP_CACHE_SIZE = int(os.getenv('PHONE_LOOKUP_CACHE_SIZE', 4096))
+
 def get_current_time():
     now = datetime.now()
     return {
@@ -117,125 +267,60 @@ def get_current_time():
         'time': now.strftime("%I:%M %p")
     }
 
+class PrefixTrie:
+    """Digit trie answering longest-prefix-match queries."""
+
+    def __init__(self, entries=()):
+        self.root = {}
+        for prefix, value in entries:
+            self.insert(prefix, value)
+
+    def insert(self, prefix, value):
+        node = self.root
+        for digit in prefix:
+            node = node.setdefault(digit, {})
+        node[None] = value
+
+    def longest_match(self, text, start=0):
+        """Return (value, end) for the longest prefix of text[start:], or (None, start)."""
+        node = self.root
+        match = (None, start)
+        for pos in range(start, len(text)):
+            node = node.get(text[pos])
+            if node is None:
+                break
+            if None in node:
+                match = (node[None], pos + 1)
+        return match
+
+def build_phone_tries(table):
+    """Compile PHONE_PREFIXES into a country trie whose values carry an operator trie."""
+    return PrefixTrie(
+        (code, (country, PrefixTrie(
+            (prefix, network) for network, prefixes in operators.items() for prefix in prefixes
+        )))
+        for code, (country, operators) in table.items()
+    )
+
+phone_trie = build_phone_tries(PHONE_PREFIXES)
+
+def match_phone(trie, phone):
+    """Look a phone number up in a trie from build_phone_tries; returns (network, country)."""
+    start = 1 if phone.startswith("+") else 0
+    entry, pos = trie.longest_match(phone, start)
+    if entry is None:
+        return "Unknown", "Unknown"
+    country, operators = entry
+    # Skip the trunk prefix: +256 0772... and +256 772... are the same number
+    while pos < len(phone) and phone[pos] == "0":
+        pos += 1
+    network, _ = operators.longest_match(phone, pos)
+    return network or "Unknown", country
+
+@lru_cache(maxsize=PHONE_LOOKUP_CACHE_SIZE)
 def detect_network_and_country(phone):
     """Detect network and country based on phone number prefix."""
-    # Uganda
-    if phone.startswith("+256") or phone.startswith("256"):
-        country = "Uganda 🇺🇬"
-        # Airtel: 075, 070, 074, 020; MTN: 077, 078, 039; Africell: 079; UTL: 071, 041; Vodafone: 072
-        prefix = re.sub(r"^\+?256", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("75") or prefix.startswith("70") or prefix.startswith("74") or prefix.startswith("20"):
-            network = "Airtel"
-        elif prefix.startswith("77") or prefix.startswith("78") or prefix.startswith("39"):
-            network = "MTN"
-        elif prefix.startswith("79"):
-            network = "Africell"
-        elif prefix.startswith("71") or prefix.startswith("41"):
-            network = "Uganda Telecom"
-        elif prefix.startswith("72"):
-            network = "Vodafone"
-        else:
-            network = "Unknown"
-    # Kenya
-    elif phone.startswith("+254") or phone.startswith("254"):
-        country = "Kenya 🇰🇪"
-        prefix = re.sub(r"^\+?254", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("7"):
-            network = "Safaricom"
-        elif prefix.startswith("10") or prefix.startswith("11"):
-            network = "Airtel"
-        elif prefix.startswith("20"):
-            network = "Telkom"
-        else:
-            network = "Unknown"
-    # Tanzania
-    elif phone.startswith("+255") or phone.startswith("255"):
-        country = "Tanzania 🇹🇿"
-        prefix = re.sub(r"^\+?255", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("65") or prefix.startswith("68"):
-            network = "Airtel"
-        elif prefix.startswith("75") or prefix.startswith("76"):
-            network = "Vodacom"
-        elif prefix.startswith("71"):
-            network = "Tigo"
-        else:
-            network = "Unknown"
-    # Rwanda
-    elif phone.startswith("+250") or phone.startswith("250"):
-        country = "Rwanda 🇷🇼"
-        prefix = re.sub(r"^\+?250", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("78") or prefix.startswith("79"):
-            network = "MTN"
-        elif prefix.startswith("72"):
-            network = "Airtel"
-        else:
-            network = "Unknown"
-
-        # Ethiopia
-    elif phone.startswith("+251") or phone.startswith("251"):
-        country = "Ethiopia 🇪🇹"
-        prefix = re.sub(r"^\+?251", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("91") or prefix.startswith("90") or prefix.startswith("96"):
-            network = "Ethio Telecom"
-        else:
-            network = "Unknown"
-    # Nigeria
-    elif phone.startswith("+234") or phone.startswith("234"):
-        country = "Nigeria 🇳🇬"
-        prefix = re.sub(r"^\+?234", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith(("701", "702", "703", "704", "705", "706", "707", "708", "709")):
-            network = "MTN or Glo or Airtel or 9mobile (check exact prefix)"
-        elif prefix.startswith(("802", "803", "804", "805", "806", "807", "808", "809")):
-            network = "MTN or Glo or Airtel (legacy numbers)"
-        else:
-            network = "Unknown"
-    # Ghana
-    elif phone.startswith("+233") or phone.startswith("233"):
-        country = "Ghana 🇬🇭"
-        prefix = re.sub(r"^\+?233", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("24") or prefix.startswith("54") or prefix.startswith("55"):
-            network = "MTN"
-        elif prefix.startswith("20") or prefix.startswith("50"):
-            network = "Vodafone"
-        elif prefix.startswith("26") or prefix.startswith("56"):
-            network = "AirtelTigo"
-        else:
-            network = "Unknown"
-    # Zimbabwe
-    elif phone.startswith("+263") or phone.startswith("263"):
-        country = "Zimbabwe 🇿🇼"
-        prefix = re.sub(r"^\+?263", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("71"):
-            network = "Econet"
-        elif prefix.startswith("73"):
-            network = "Telecel"
-        elif prefix.startswith("77"):
-            network = "NetOne"
-        else:
-            network = "Unknown"
-    # Mali
-    elif phone.startswith("+223") or phone.startswith("223"):
-        country = "Mali 🇲🇱"
-        prefix = re.sub(r"^\+?223", "", phone)
-        prefix = prefix.lstrip("0")
-        if prefix.startswith("7"):
-            network = "Orange Mali"
-        elif prefix.startswith("6"):
-            network = "Malitel"
-        else:
-            network = "Unknown"
-    else:
-        country = "Unknown"
-        network = "Unknown"
-    return network, country
+    return match_phone(phone_trie, phone)
 
 def generate_airtime_message(phone, amount, name):
     network, country = detect_network_and_country(phone)
@@ -258,81 +343,828 @@ def generate_airtime_message(phone, amount, name):
 """
 
 # Database Management Functions
-def add_user(user):
+class RecentUsers:
+    """Bounded LRU of user_id -> hash of the profile last written for them."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.skipped = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def profile_hash(user):
+        return hash((user.username, user.first_name, user.last_name))
+
+    def is_current(self, user):
+        """True if this exact profile was written for the user within the TTL."""
+        entry = self._entries.get(user.id)
+        if entry is None or entry[1] < time.monotonic():
+            return False
+        if entry[0] != self.profile_hash(user):
+            return False
+        self._entries.move_to_end(user.id)
+        self.skipped += 1
+        return True
+
+    def remember(self, user):
+        self._entries[user.id] = (self.profile_hash(user), time.monotonic() + self.ttl)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        self._entries.pop(user_id, None)
+
+recent_users = RecentUsers(RECENT_USERS_CACHE_SIZE, RECENT_USERS_TTL)
+
+async def add_user(user):
     """Add user to database if not exists"""
-    users_collection.update_one(
+    if recent_users.is_current(user):
+        return
+    # Unchanged profiles make this a no-op on the server
+    result = await users_collection.update_one(
         {'user_id': user.id},
         {'$set': {
             'username': user.username,
             'first_name': user.first_name,
             'last_name': user.last_name,
+        },
+        # Running totals are maintained by add_airtime_transaction
+        '$setOnInsert': {
             'join_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'airtime_sent': 0,
             'transactions': 0
-        }},
+        },
+        # Coming back through /start proves the user can be reached again
+        '$unset': {'unreachable_at': '', 'unreachable_reason': ''}},
         upsert=True
     )
+    recent_users.remember(user)
+    if result.upserted_id is not None:
+        await counters_collection.update_one(
+            {'_id': STATS_COUNTERS_ID},
+            {'$inc': {'total_users': 1, f"new_users.{datetime.now().strftime('%Y-%m-%d')}": 1}},
+            upsert=True
+        )
+    if result.upserted_id is not None or result.modified_count:
+        for cache in leaderboard_caches.values():
+            cache.on_profile_changed(user.id)
+
+class AdminSet:
+    """CONFIG['admin_ids'] plus the admins collection, held in memory.
+
+    Kept current by a change stream on the collection, or by polling every
+    ADMIN_REFRESH_INTERVAL seconds where change streams aren't available
+    (standalone servers).
+    """
+
+    def __init__(self, static_ids):
+        self.static_ids = frozenset(static_ids)
+        self.ids = self.static_ids
+
+    async def reload(self):
+        ids = {doc['user_id'] async for doc in admins_collection.find({}, {'user_id': 1})}
+        self.ids = self.static_ids | frozenset(ids)
+
+    async def watch(self):
+        """Reload whenever the collection changes. Runs until cancelled."""
+        while True:
+            try:
+                async with await admins_collection.watch() as stream:
+                    # Catch changes made while the stream was being opened
+                    await self.reload()
+                    async for _ in stream:
+                        await self.reload()
+            except OperationFailure as e:
+                logger.info(f"Admin change stream unavailable, polling instead: {e}")
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Admin change stream failed: {e}")
+                await asyncio.sleep(ADMIN_REFRESH_INTERVAL)
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(ADMIN_REFRESH_INTERVAL)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Error reloading admins: {e}")
+
+admin_set = AdminSet(CONFIG['admin_ids'])
 
 def is_admin(user_id):
-    """Check if user is admin"""
-    return admins_collection.count_documents({'user_id': user_id}) > 0 or user_id in CONFIG['admin_ids']
+    """Check if user is admin. No I/O."""
+    return user_id in admin_set.ids
+
+class LeaderboardCache:
+    """Rendered leaderboard text, dropped only when a write could change it.
+
+    Every invalidation bumps generation; a result is only stored if no
+    invalidation happened while it was being queried.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.generation = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self.generation += 1
+        self.text = None
+        self.key = None
+        self.user_ids = set()
+        self.threshold = 0
+        self.expires_at = 0
+
+    def get(self, key=None):
+        """Return the cached text, or None if it must be rebuilt or belongs to another bucket."""
+        if self.text is not None and self.key == key and time.monotonic() < self.expires_at:
+            return self.text
+        return None
+
+    def store(self, entries, text, key, generation):
+        """Cache a result queried while the cache was at generation."""
+        if generation != self.generation:
+            return
+        self.text = text
+        self.key = key
+        self.user_ids = {entry['_id'] for entry in entries}
+        # With a full board, only totals above the lowest entry can get in
+        self.threshold = entries[-1]['total_amount'] if len(entries) >= LEADERBOARD_SIZE else 0
+        self.expires_at = time.monotonic() + self.ttl
+
+    def on_total_changed(self, user_id, total):
+        """Invalidate if the user is on the board or has just climbed onto it.
+
+        For period boards the all-time total is passed; it bounds the period
+        total from above, so the check stays safe.
+        """
+        if user_id in self.user_ids or total > self.threshold:
+            self.invalidate()
+
+    def on_profile_changed(self, user_id):
+        """Invalidate if a listed user's display name may have changed."""
+        if user_id in self.user_ids:
+            self.invalidate()
+
+leaderboard_caches = {board: LeaderboardCache(LEADERBOARD_CACHE_TTL) for board in LEADERBOARD_BOARDS}
+
+def period_bucket(period, when):
+    """Return the bucket key, start and end of the period containing when."""
+    day = datetime(when.year, when.month, when.day)
+    if period == 'daily':
+        return day.strftime('%Y-%m-%d'), day, day + timedelta(days=1)
+    if period == 'weekly':
+        start = day - timedelta(days=day.weekday())
+        return start.strftime('%G-W%V'), start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start.strftime('%Y-%m'), start, (start + timedelta(days=32)).replace(day=1)
+
+def bucket_update(period, user_id, username, amount, when, batch_id=None):
+    """Upsert that adds amount to a user's bucket for the period containing when.
+
+    With a batch_id (write-behind), the update is skipped if that batch was
+    already applied to the bucket.
+    """
+    key, _, end = period_bucket(period, when)
+    query = {'period': period, 'bucket': key, 'user_id': user_id}
+    update = {
+        '$inc': {'total': amount},
+        '$set': {'username': username},
+        # The TTL index drops the bucket a day after its period ends
+        '$setOnInsert': {'expires_at': end + timedelta(days=1)}
+    }
+    if batch_id is not None:
+        query['applied_batches'] = {'$ne': batch_id}
+        update.update(applied_batch_push(batch_id))
+    return UpdateOne(query, update, upsert=True)
 
-def add_airtime_transaction(user_id, username, phone_number, amount):
+async def add_airtime_transaction(user_id, username, phone_number, amount):
     """Add airtime transaction to leaderboard"""
+    now = datetime.now()
     transaction = {
         'user_id': user_id,
         'username': username,
         'phone_number': phone_number,
         'amount': amount,
-        'transaction_date': datetime.now(),
+        'transaction_date': now,
         'txn_id': f"TX{random.randint(100000, 999999)}"
     }
-    
-    leaderboard_collection.insert_one(transaction)
+    # A full buffer falls through to the direct writes below
+    if transaction_buffer and transaction_buffer.add(transaction):
+        return
+
+    await leaderboard_collection.insert_one(transaction)
+    await leaderboard_buckets_collection.bulk_write(
+        [bucket_update(period, user_id, username, amount, now) for period in LEADERBOARD_PERIODS],
+        ordered=False
+    )
     
     # Update user stats
-    users_collection.update_one(
+    user_doc = await users_collection.find_one_and_update(
         {'user_id': user_id},
-        {'$inc': {'airtime_sent': amount, 'transactions': 1}}
+        {'$inc': {'airtime_sent': amount, 'transactions': 1}},
+        projection={'airtime_sent': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user_doc:
+        for cache in leaderboard_caches.values():
+            cache.on_total_changed(user_id, user_doc['airtime_sent'])
+    await counters_collection.update_one(
+        {'_id': STATS_COUNTERS_ID},
+        {'$inc': {'total_transactions': 1, 'total_volume': amount}},
+        upsert=True
     )
 
-def get_leaderboard():
-    """Get top 10 senders by total amount sent"""
-    pipeline = [
-        {"$group": {
-            "_id": "$user_id",
-            "username": {"$first": "$username"},
-            "total_amount": {"$sum": "$amount"}
-        }},
-        {"$sort": {"total_amount": -1}},
-        {"$limit": 10}
+class TransactionBuffer:
+    """Write-behind buffer for airtime transactions.
+
+    Transactions are flushed every interval_ms or once batch_size are
+    waiting: one insert_many into the transaction log, then one bulk_write
+    each of merged bucket and user $incs and a single counters $inc.
+
+    Each inserted batch gets an id, and every totals update is guarded on
+    that id not being in the document's applied_batches, so a batch whose
+    totals failed part way is simply retried later without double counting.
+    Failed flushes are retried with exponential backoff, up to
+    WRITE_BEHIND_MAX_BACKOFF seconds apart. max_pending caps every
+    transaction held, buffered or awaiting a retry; past it add() refuses
+    the transaction and the caller writes it directly.
+    """
+
+    def __init__(self, interval_ms, batch_size, max_pending):
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.flushed = 0
+        self.last_batch = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.bypassed = 0
+        self.held = 0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._pending = []
+        # (batch_id, transactions) already in the log whose totals aren't applied yet
+        self._unapplied = []
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def add(self, transaction):
+        """Buffer a transaction. Returns False when the buffer is full."""
+        if self.held >= self.max_pending:
+            self.bypassed += 1
+            return False
+        self.held += 1
+        self._pending.append(transaction)
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        return True
+
+    async def flush(self):
+        """Write everything buffered so far. Returns False if anything is left to retry."""
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._full.clear()
+            if not batch and not self._unapplied:
+                return True
+            started = time.monotonic()
+            if batch:
+                try:
+                    # insert_many fills in _id, so a retried batch can't insert twice
+                    await leaderboard_collection.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                        self._pending[:0] = batch
+                        return self._failed(f"writing {len(batch)} buffered transactions", e)
+                except Exception as e:
+                    self._pending[:0] = batch
+                    return self._failed(f"writing {len(batch)} buffered transactions", e)
+                self._unapplied.append((ObjectId(), batch))
+            # Oldest first, so a batch is always retried before later ones are applied
+            while self._unapplied:
+                batch_id, applied = self._unapplied[0]
+                try:
+                    await self._apply_totals(batch_id, applied)
+                except Exception as e:
+                    return self._failed(f"applying totals for {len(applied)} transactions", e)
+                self._unapplied.pop(0)
+                self.held -= len(applied)
+                self.flushes += 1
+                self.flushed += len(applied)
+                self.last_batch = len(applied)
+            self._failures = 0
+            self.last_latency = time.monotonic() - started
+            self.max_latency = max(self.max_latency, self.last_latency)
+            return True
+
+    def _failed(self, what, error):
+        self._failures += 1
+        delay = min(WRITE_BEHIND_MAX_BACKOFF, self.interval * 2 ** self._failures)
+        self._retry_at = time.monotonic() + delay
+        logger.error(f"Error {what}, retrying in {delay:.1f}s: {error}")
+        return False
+
+    async def _apply_totals(self, batch_id, batch):
+        """Merge the batch's increments per user and per bucket and write them, once."""
+        users = {}
+        buckets = {}
+        for txn in batch:
+            user_id, amount = txn['user_id'], txn['amount']
+            total, count = users.get(user_id, (0, 0))
+            users[user_id] = (total + amount, count + 1)
+            for period in LEADERBOARD_PERIODS:
+                key = (period, period_bucket(period, txn['transaction_date'])[0], user_id)
+                merged = buckets.get(key)
+                buckets[key] = (txn, amount + (merged[1] if merged else 0))
+
+        # A guarded upsert on a bucket that already has this batch collides
+        # with the unique index instead of inserting; that means "done"
+        await bulk_write_applied(leaderboard_buckets_collection, [
+            bucket_update(period, user_id, txn['username'], amount, txn['transaction_date'], batch_id)
+            for (period, _, user_id), (txn, amount) in buckets.items()
+        ])
+        await bulk_write_applied(users_collection, [
+            UpdateOne(
+                {'user_id': user_id, 'applied_batches': {'$ne': batch_id}},
+                {'$inc': {'airtime_sent': total, 'transactions': count}, **applied_batch_push(batch_id)}
+            )
+            for user_id, (total, count) in users.items()
+        ])
+        try:
+            await counters_collection.update_one(
+                {'_id': STATS_COUNTERS_ID, 'applied_batches': {'$ne': batch_id}},
+                {'$inc': {'total_transactions': len(batch), 'total_volume': sum(txn['amount'] for txn in batch)},
+                 **applied_batch_push(batch_id)},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+        async for user in users_collection.find({'user_id': {'$in': list(users)}}, {'user_id': 1, 'airtime_sent': 1}):
+            for cache in leaderboard_caches.values():
+                cache.on_total_changed(user['user_id'], user['airtime_sent'])
+
+    async def close(self):
+        """Flush on shutdown, retrying until WRITE_BEHIND_SHUTDOWN_GRACE runs out."""
+        deadline = time.monotonic() + WRITE_BEHIND_SHUTDOWN_GRACE
+        while not await self.flush() and time.monotonic() < deadline:
+            await asyncio.sleep(min(1, max(0, deadline - time.monotonic())))
+        if not self._pending and not self._unapplied:
+            return
+        # Nothing else will write these; put them in the log so they can be replayed by hand
+        logger.critical(
+            f"Shutting down with {len(self._pending)} unwritten transactions and "
+            f"{sum(len(batch) for _, batch in self._unapplied)} whose totals weren't applied"
+        )
+        for txn in self._pending:
+            logger.critical(f"Unwritten transaction: {json.dumps(txn, default=str)}")
+        for batch_id, batch in self._unapplied:
+            for txn in batch:
+                logger.critical(f"Totals not applied (batch {batch_id}): {json.dumps(txn, default=str)}")
+
+    async def run(self):
+        """Flush every interval, or sooner when a batch fills up, until cancelled."""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            backoff = self._retry_at - time.monotonic()
+            if backoff > 0:
+                await asyncio.sleep(backoff)
+            # Shielded so shutdown can't drop a batch that's already been swapped out
+            await asyncio.shield(self.flush())
+
+def applied_batch_push(batch_id):
+    """Update fragment recording a write-behind batch as applied to a document."""
+    return {'$push': {'applied_batches': {'$each': [batch_id], '$slice': -APPLIED_BATCHES_KEPT}}}
+
+async def bulk_write_applied(collection, requests):
+    """bulk_write guarded updates, treating duplicate-key upserts as already applied."""
+    try:
+        await collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+
+transaction_buffer = TransactionBuffer(
+    WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_MAX_PENDING
+) if WRITE_BEHIND else None
+
+async def get_leaderboard(board='all'):
+    """Get top 10 senders for a board: all-time running totals on users, or a period's buckets"""
+    if board in LEADERBOARD_PERIODS:
+        key, _, _ = period_bucket(board, datetime.now())
+        cursor = leaderboard_buckets_collection.find(
+            {'period': board, 'bucket': key},
+            {'user_id': 1, 'username': 1, 'total': 1}
+        ).sort('total', -1).limit(LEADERBOARD_SIZE)
+        return [
+            {'_id': entry['user_id'], 'username': entry.get('username'), 'total_amount': entry['total']}
+            async for entry in cursor
+        ]
+    cursor = users_collection.find(
+        {'airtime_sent': {'$gt': 0}},
+        {'user_id': 1, 'username': 1, 'airtime_sent': 1}
+    ).sort('airtime_sent', -1).limit(LEADERBOARD_SIZE)
+    return [
+        {'_id': user['user_id'], 'username': user.get('username'), 'total_amount': user['airtime_sent']}
+        async for user in cursor
     ]
-    return list(leaderboard_collection.aggregate(pipeline))
-
-def get_user_count():
-    """Get total number of users"""
-    return users_collection.count_documents({})
-
-def get_all_users():
-    """Get all user IDs for broadcasting"""
-    return [user['user_id'] for user in users_collection.find({}, {'user_id': 1})]
-
-async def is_member_of_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Check if the user is a member of all required channels."""
-    for channel in CHANNEL_USERNAMES:
-        channel = channel.strip()
-        if not channel.startswith("@"):
-            channel = "@" + channel
+
+# Matches users that haven't been marked unreachable (missing or null unreachable_at)
+REACHABLE_USERS = {'unreachable_at': None}
+
+async def get_user_count():
+    """Get total number of reachable users"""
+    return await users_collection.count_documents(REACHABLE_USERS)
+
+async def mark_user_unreachable(user_id, reason):
+    """Exclude a user from broadcasts until they /start the bot again"""
+    # Their next /start has to reach Mongo to clear the flag
+    recent_users.forget(user_id)
+    await users_collection.update_one(
+        {'user_id': user_id},
+        {'$set': {'unreachable_at': datetime.now(), 'unreachable_reason': reason}}
+    )
+
+async def create_unique_index(collection, keys):
+    """Create a unique index, logging instead of failing if existing data has duplicates."""
+    try:
+        await collection.create_index(keys, unique=True)
+    except OperationFailure as e:
+        logger.error(f"Can't create unique index {keys} on {collection.name}, remove the duplicates first: {e}")
+
+async def ensure_indexes():
+    """Create the indexes the bot's queries rely on"""
+    await create_unique_index(users_collection, 'user_id')
+    await create_unique_index(admins_collection, 'user_id')
+    await create_unique_index(memberships_collection, [('channel', 1), ('user_id', 1)])
+    await leaderboard_collection.create_index('user_id')
+    await leaderboard_collection.create_index('transaction_date')
+    await users_collection.create_index('unreachable_at')
+    await users_collection.create_index([('airtime_sent', -1)])
+    await leaderboard_buckets_collection.create_index(
+        [('period', 1), ('bucket', 1), ('user_id', 1)], unique=True
+    )
+    await leaderboard_buckets_collection.create_index([('period', 1), ('bucket', 1), ('total', -1)])
+    await leaderboard_buckets_collection.create_index('expires_at', expireAfterSeconds=0)
+    await jobs_collection.create_index([('status', 1), ('lease_expires', 1), ('created_at', 1)])
+    await users_collection.create_index('user_index', sparse=True)
+    await activity_collection.create_index('expires_at', expireAfterSeconds=0)
+    await media_collection.create_index('expires_at', expireAfterSeconds=0)
+
+# Hot queries whose plans are checked at startup: (collection, filter)
+INDEXED_QUERIES = [
+    (users_collection, {'user_id': 0}),
+    (admins_collection, {'user_id': 0}),
+    (leaderboard_collection, {'user_id': 0}),
+    (leaderboard_collection, {'transaction_date': {'$gte': datetime(2000, 1, 1)}}),
+    (memberships_collection, {'channel': {'$in': ['@channel']}}),
+    (users_collection, {'user_id': {'$in': [0]}}),
+    (leaderboard_buckets_collection, {'period': 'daily', 'bucket': '', 'user_id': 0}),
+]
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+async def check_query_plans():
+    """Warn about registered queries that would scan their whole collection."""
+    for collection, query in INDEXED_QUERIES:
         try:
-            chat_member = await context.bot.get_chat_member(channel, user_id)
-            # Acceptable statuses: member, administrator, creator
-            if chat_member.status not in ["member", "administrator", "creator"]:
+            explain = await collection.find(query).explain()
+        except OperationFailure as e:
+            logger.warning(f"Can't explain query on {collection.name}: {e}")
+            continue
+        if 'COLLSCAN' in plan_stages(explain.get('queryPlanner', {}).get('winningPlan')):
+            logger.warning(f"Query {query} on {collection.name} is a collection scan")
+
+# Bitmaps are stored as 64-bit words: {'_id': day, 'w': {'<word>': <int64>}}
+WORD_MASK = (1 << 64) - 1
+
+def to_int64(word):
+    """Reinterpret an unsigned 64-bit word as the signed value BSON stores."""
+    return Int64(word - (1 << 64) if word >= 1 << 63 else word)
+
+class ActivityTracker:
+    """Buffers active users per day in memory and ORs them into per-day Mongo bitmaps.
+
+    Each user gets a dense user_index the first time they are flushed; bit
+    user_index of a day's bitmap is set when they were active that day.
+    """
+
+    def __init__(self, index_cache_size):
+        self.index_cache_size = index_cache_size
+        self._pending = {}
+        self._indexes = OrderedDict()
+
+    def record(self, user_id):
+        """Mark a user active today. No I/O."""
+        self._pending.setdefault(datetime.now().strftime('%Y-%m-%d'), set()).add(user_id)
+
+    def _remember(self, user_id, user_index):
+        self._indexes[user_id] = user_index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.index_cache_size:
+            self._indexes.popitem(last=False)
+
+    async def _resolve_indexes(self, user_ids):
+        """Map user ids to dense indexes, allocating indexes for users without one."""
+        resolved = {}
+        unknown = []
+        for user_id in user_ids:
+            if user_id in self._indexes:
+                resolved[user_id] = self._indexes[user_id]
+                self._indexes.move_to_end(user_id)
+            else:
+                unknown.append(user_id)
+        if not unknown:
+            return resolved
+        missing = set()
+        async for user in users_collection.find({'user_id': {'$in': unknown}}, {'user_id': 1, 'user_index': 1}):
+            if 'user_index' in user:
+                resolved[user['user_id']] = user['user_index']
+                self._remember(user['user_id'], user['user_index'])
+            else:
+                missing.add(user['user_id'])
+        if missing:
+            counters = await counters_collection.find_one_and_update(
+                {'_id': STATS_COUNTERS_ID},
+                {'$inc': {'next_user_index': len(missing)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            first = counters['next_user_index'] - len(missing)
+            await users_collection.bulk_write([
+                UpdateOne({'user_id': user_id, 'user_index': {'$exists': False}}, {'$set': {'user_index': first + i}})
+                for i, user_id in enumerate(missing)
+            ], ordered=False)
+            # Another instance may have assigned some of these first; read back the winners
+            async for user in users_collection.find({'user_id': {'$in': list(missing)}}, {'user_id': 1, 'user_index': 1}):
+                resolved[user['user_id']] = user['user_index']
+                self._remember(user['user_id'], user['user_index'])
+        return resolved
+
+    async def flush(self):
+        """Write buffered activity to Mongo with atomic bitwise ORs."""
+        pending, self._pending = self._pending, {}
+        for day, user_ids in pending.items():
+            try:
+                indexes = await self._resolve_indexes(user_ids)
+                words = {}
+                for user_index in indexes.values():
+                    words[user_index >> 6] = words.get(user_index >> 6, 0) | (1 << (user_index & 63))
+                if not words:
+                    continue
+                expires_at = datetime.strptime(day, '%Y-%m-%d') + timedelta(days=ACTIVITY_RETENTION_DAYS)
+                await activity_collection.update_one(
+                    {'_id': day},
+                    {
+                        '$bit': {f'w.{word}': {'or': to_int64(bits)} for word, bits in words.items()},
+                        '$setOnInsert': {'expires_at': expires_at}
+                    },
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Error flushing activity for {day}: {e}")
+                self._pending.setdefault(day, set()).update(user_ids)
+
+    async def run(self):
+        """Flush periodically until cancelled."""
+        while True:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            # Shielded so shutdown can't drop a batch that's already been swapped out
+            await asyncio.shield(self.flush())
+
+activity_tracker = ActivityTracker(ACTIVITY_INDEX_CACHE_SIZE)
+
+def union_bitmaps(bitmaps):
+    """OR several {word: bits} bitmaps together."""
+    result = {}
+    for bitmap in bitmaps:
+        for word, bits in bitmap.items():
+            result[word] = result.get(word, 0) | bits
+    return result
+
+def popcount(bitmap):
+    return sum(bin(bits).count('1') for bits in bitmap.values())
+
+async def get_activity_stats():
+    """Return DAU, WAU, MAU and D1/D7 retention (in percent) from the daily bitmaps."""
+    today = datetime.now()
+    days = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(30)]
+    bitmaps = {day: {} for day in days}
+    async for doc in activity_collection.find({'_id': {'$in': days}}, {'w': 1}):
+        bitmaps[doc['_id']] = {int(word): bits & WORD_MASK for word, bits in doc.get('w', {}).items()}
+
+    def retention(days_ago):
+        cohort = bitmaps[days[days_ago]]
+        retained = {word: bits & bitmaps[days[0]].get(word, 0) for word, bits in cohort.items()}
+        cohort_size = popcount(cohort)
+        return popcount(retained) * 100 / cohort_size if cohort_size else 0
+
+    return {
+        'dau': popcount(bitmaps[days[0]]),
+        'wau': popcount(union_bitmaps(bitmaps[day] for day in days[:7])),
+        'mau': popcount(union_bitmaps(bitmaps.values())),
+        'd1_retention': retention(1),
+        'd7_retention': retention(7),
+    }
+
+class MembershipCache:
+    """LRU cache of (user_id, channel) -> is_member with per-entry expiry."""
+
+    def __init__(self, ttl, negative_ttl, max_size):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, user_id, channel):
+        """Return the cached status, or None if missing or expired."""
+        key = (user_id, channel)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return is_member
+
+    def set(self, user_id, channel, is_member):
+        """Store a status; negative results expire after the short TTL."""
+        ttl = self.ttl if is_member else self.negative_ttl
+        key = (user_id, channel)
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id, channels):
+        """Drop the cached statuses of a user for the given channels."""
+        for channel in channels:
+            self._entries.pop((user_id, channel), None)
+
+membership_cache = MembershipCache(MEMBERSHIP_CACHE_TTL, MEMBERSHIP_NEGATIVE_TTL, MEMBERSHIP_CACHE_SIZE)
+
+# Statuses that count as being in a channel
+MEMBER_STATUSES = ["member", "administrator", "creator"]
+
+def normalize_channel(channel):
+    """Strip whitespace, lowercase and make sure the channel starts with @."""
+    channel = channel.strip().lower()
+    if not channel.startswith("@"):
+        channel = "@" + channel
+    return channel
+
+class MembershipIndex:
+    """Membership of users in the channels the bot administers, fed by chat_member updates.
+
+    Only the instance that receives a chat_member update records it, so
+    every instance re-reads the persisted index every
+    MEMBERSHIP_INDEX_REFRESH seconds to pick up the others' changes.
+    """
+
+    def __init__(self):
+        self.observable = set()
+        self.api_calls_saved = 0
+        self._members = {}
+
+    def lookup(self, user_id, channel):
+        """Return the indexed status, or None if the channel or user isn't tracked."""
+        if channel not in self.observable:
+            return None
+        is_member = self._members.get((user_id, channel))
+        if is_member is not None:
+            self.api_calls_saved += 1
+        return is_member
+
+    async def record(self, user_id, channel, is_member):
+        """Store a status in memory and persist it to Mongo."""
+        if channel not in self.observable or self._members.get((user_id, channel)) == is_member:
+            return
+        self._members[(user_id, channel)] = is_member
+        await memberships_collection.update_one(
+            {'user_id': user_id, 'channel': channel},
+            {'$set': {'is_member': is_member, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+    async def set_observable(self, channel, observable):
+        """Start or stop trusting the index for a channel."""
+        if observable:
+            self.observable.add(channel)
+            return
+        self.observable.discard(channel)
+        self._members = {key: value for key, value in self._members.items() if key[1] != channel}
+        await memberships_collection.delete_many({'channel': channel})
+
+    async def reconcile(self, bot):
+        """Work out which channels the bot can observe and reload the index for them."""
+        for channel in map(normalize_channel, CHANNEL_USERNAMES):
+            try:
+                chat_member = await bot.get_chat_member(channel, bot.id)
+                observable = chat_member.status == "administrator"
+            except TelegramError as e:
+                logger.warning(f"Can't observe {channel}, falling back to live checks: {e}")
+                observable = False
+            await self.set_observable(channel, observable)
+        # Entries for channels we can no longer observe may be stale
+        await memberships_collection.delete_many({'channel': {'$nin': list(self.observable)}})
+        await self.reload()
+        logger.info(
+            f"Membership index: {len(self._members)} entries, "
+            f"observing {', '.join(sorted(self.observable)) or 'no channels'}"
+        )
+
+    async def reload(self):
+        """Replace the in-memory index with what every instance has persisted."""
+        members = {}
+        async for doc in memberships_collection.find({'channel': {'$in': list(self.observable)}}):
+            members[(doc['user_id'], doc['channel'])] = doc['is_member']
+        self._members = members
+
+    async def run(self):
+        """Reload periodically until cancelled."""
+        while True:
+            await asyncio.sleep(MEMBERSHIP_INDEX_REFRESH)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Error reloading membership index: {e}")
+
+membership_index = MembershipIndex()
+
+async def check_channel_membership(user_id: int, channel: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Ask the Bot API whether the user is in one channel and cache the answer."""
+    try:
+        chat_member = await context.bot.get_chat_member(channel, user_id)
+    except BadRequest as e:
+        # If bot is not admin or can't access the channel, log the error
+        logger.warning(f"Error checking membership for {channel}: {e}")
+        return False
+    # Acceptable statuses: member, administrator, creator
+    is_member = chat_member.status in MEMBER_STATUSES
+    membership_cache.set(user_id, channel, is_member)
+    await membership_index.record(user_id, channel, is_member)
+    return is_member
+
+async def is_member_of_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE, recheck_negatives=False) -> bool:
+    """Check if the user is a member of all required channels.
+
+    With recheck_negatives, channels the index or cache say the user isn't
+    in are checked live instead of trusted.
+    """
+    missing = []
+    for channel in map(normalize_channel, CHANNEL_USERNAMES):
+        known = membership_index.lookup(user_id, channel)
+        if known is None:
+            known = membership_cache.get(user_id, channel)
+        if known is False:
+            if not recheck_negatives:
                 return False
-        except BadRequest as e:
-            # If bot is not admin or can't access the channel, log the error
-            logger.warning(f"Error checking membership for {channel}: {e}")
-            return False
-    return True
+            known = None
+        if known is None:
+            missing.append(channel)
+    if not missing:
+        return True
+    results = await asyncio.gather(
+        *(check_channel_membership(user_id, channel, context) for channel in missing)
+    )
+    return all(results)
+
+async def track_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the membership index in sync with chat_member updates from our channels."""
+    chat_member = update.chat_member
+    if not chat_member.chat.username:
+        return
+    channel = normalize_channel(chat_member.chat.username)
+    user_id = chat_member.new_chat_member.user.id
+    is_member = chat_member.new_chat_member.status in MEMBER_STATUSES
+    membership_cache.invalidate(user_id, [channel])
+    await membership_index.record(user_id, channel, is_member)
+
+async def track_bot_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start or stop observing a channel when the bot's own rights change."""
+    chat_member = update.my_chat_member
+    if not chat_member.chat.username:
+        return
+    channel = normalize_channel(chat_member.chat.username)
+    if channel not in map(normalize_channel, CHANNEL_USERNAMES):
+        return
+    await membership_index.set_observable(channel, chat_member.new_chat_member.status == "administrator")
 
 async def send_force_join_message(update: Update):
     """Send force join message with buttons for all channels (without @ in button text)."""
@@ -355,8 +1187,11 @@ async def verify_join_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     """Handle join verification callback"""
     query = update.callback_query
     user_id = query.from_user.id
+    # The user claims to have just joined, so don't trust cached negatives; the
+    # index's own negatives may predate a chat_member update that hasn't arrived yet
+    membership_cache.invalidate(user_id, map(normalize_channel, CHANNEL_USERNAMES))
     
-    if await is_member_of_channels(user_id, context):
+    if await is_member_of_channels(user_id, context, recheck_negatives=True):
         await query.answer("✅ Verification successful! You can now use the bot.")
         await query.message.edit_text(
             "✅ *Vᴇʀɪꜰɪᴄᴀᴛɪᴏɴ Cᴏᴍᴘʟᴇᴛᴇ!*\n\n"
@@ -371,23 +1206,25 @@ async def verify_join_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command with welcome image."""
     user = update.effective_user
-    add_user(user)
+    await add_user(user)
     
     if not await is_member_of_channels(user.id, context):
         await send_force_join_message(update)
         return
 
-    # Send notification to channel
-    await send_notification(context.bot, user.id, user.username, "Started the bot")
+    # Queue notification to channel; rendering and upload happen in the background
+    notification_pipeline.submit(context.bot, user.id, user.username, "Started the bot")
 
     keyboard = [
         [InlineKeyboardButton("💸 Send Airtime", callback_data="send_airtime")],
     ]
     
     try:
-        await context.bot.send_photo(
+        await send_registered_photo(
+            context.bot,
+            url_media_key(CONFIG['welcome_image']),
+            CONFIG['welcome_image'],
             chat_id=user.id,
-            photo=CONFIG['welcome_image'],
             caption=WELCOME_MESSAGE,
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -400,9 +1237,113 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
+class AdmissionControl:
+    """Per-user flood limits and a global cap on in-flight transfer animations.
+
+    Each user gets a token bucket of `burst` flows refilled at `user_rate`
+    per minute. Buckets live in an LRU of at most `max_users` entries; an
+    evicted user just starts again with a full bucket.
+    """
+
+    SETTINGS = {
+        'user_rate': float,
+        'user_burst': int,
+        'max_animations': int,
+    }
+
+    def __init__(self, user_rate, user_burst, max_animations, max_users):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_animations = max_animations
+        self.max_users = max_users
+        self.in_flight = 0
+        self.rejected_user = 0
+        self.rejected_busy = 0
+        self._buckets = OrderedDict()
+
+    def saturated(self):
+        return self.in_flight >= self.max_animations
+
+    def admit(self, user_id):
+        """Spend one of the user's tokens. Returns None, 'user' or 'busy'."""
+        if self.saturated():
+            self.rejected_busy += 1
+            return 'busy'
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(user_id, (self.user_burst, now))
+        tokens = min(self.user_burst, tokens + (now - updated) * self.user_rate / 60)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.rejected_user += 1
+            return 'user'
+        self._buckets[user_id] = (tokens - 1, now)
+        while len(self._buckets) > self.max_users:
+            self._buckets.popitem(last=False)
+        return None
+
+    def start(self):
+        """Reserve an animation slot; False if the system is saturated."""
+        if self.saturated():
+            self.rejected_busy += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def finish(self):
+        self.in_flight -= 1
+
+    def settings(self):
+        return {name: getattr(self, name) for name in self.SETTINGS}
+
+    def configure(self, name, value):
+        """Parse and apply one setting; raises ValueError on bad input."""
+        if name not in self.SETTINGS:
+            raise ValueError(f"Unknown setting {name}")
+        value = self.SETTINGS[name](value)
+        if value <= 0:
+            raise ValueError(f"{name} must be positive")
+        setattr(self, name, value)
+        return value
+
+    async def load(self):
+        """Apply settings an admin saved earlier, if any."""
+        doc = await settings_collection.find_one({'_id': ADMISSION_SETTINGS_ID})
+        for name, value in (doc or {}).items():
+            if name in self.SETTINGS:
+                setattr(self, name, value)
+
+    async def save(self):
+        await settings_collection.update_one(
+            {'_id': ADMISSION_SETTINGS_ID},
+            {'$set': self.settings()},
+            upsert=True
+        )
+
+admission = AdmissionControl(
+    ADMISSION_USER_RATE, ADMISSION_USER_BURST, ADMISSION_MAX_ANIMATIONS, ADMISSION_TRACKED_USERS
+)
+
+ADMISSION_MESSAGES = {
+    'user': "⏳ Slow down! Try again in a minute.",
+    'busy': "🚦 Too many transfers right now. Try again shortly.",
+}
+
+async def reject_admission(update: Update, reason):
+    """Turn a request away with as few API calls as possible."""
+    if update.callback_query:
+        await update.callback_query.answer(ADMISSION_MESSAGES[reason])
+    else:
+        await update.message.reply_text(ADMISSION_MESSAGES[reason])
+
 async def send_airtime(update: Union[Update, CallbackQueryHandler], context: ContextTypes.DEFAULT_TYPE):
     """Handle airtime sending process."""
     user = update.effective_user
+
+    # Checked before the membership lookup so rejected users cost no API calls
+    reason = admission.admit(user.id)
+    if reason:
+        await reject_admission(update, reason)
+        return
     
     if not await is_member_of_channels(user.id, context):
         await send_force_join_message(update)
@@ -423,11 +1364,9 @@ async def send_airtime(update: Union[Update, CallbackQueryHandler], context: Con
         parse_mode="Markdown"
     )
 
-async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle leaderboard callback from inline button or command."""
-    query = getattr(update, "callback_query", None)
-    leaderboard_data = get_leaderboard()
-    leaderboard_text = "🏆 Tᴏᴘ 10 ꜱᴇɴᴅᴇʀꜱ\n━━━━━━━━━━━━━━━━━\n"
+def render_leaderboard(leaderboard_data, board='all'):
+    """Render leaderboard entries as message text."""
+    leaderboard_text = f"🏆 Tᴏᴘ 10 ꜱᴇɴᴅᴇʀꜱ • {LEADERBOARD_BOARDS[board]}\n━━━━━━━━━━━━━━━━━\n"
     medals = ["🥇", "🥈", "🥉"] + ["🔹"] * 7
     for idx, entry in enumerate(leaderboard_data):
         username = entry.get('username', 'Anonymous')
@@ -437,16 +1376,45 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         leaderboard_text += f"{medals[idx]} {username}: {entry['total_amount']:,} UGX\n"
     if not leaderboard_data:
         leaderboard_text += "\nLᴇᴀᴅᴇʀʙᴏᴀʀᴅ ɪꜱ ᴇᴍᴘᴛʏ! ʙᴇ ᴛʜᴇ ꜰɪʀꜱᴛ ᴡɪᴛʜ /sendairtime"
+    return leaderboard_text
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle leaderboard callback from inline button or command."""
+    query = getattr(update, "callback_query", None)
+    # Board comes from the callback data (show_leaderboard:weekly) or the command argument
+    if query:
+        board = query.data.partition(":")[2] or 'all'
+    else:
+        board = context.args[0].lower() if context.args else 'all'
+    if board not in LEADERBOARD_BOARDS:
+        board = 'all'
+    bucket = period_bucket(board, datetime.now())[0] if board in LEADERBOARD_PERIODS else None
+    cache = leaderboard_caches[board]
+    leaderboard_text = cache.get(bucket)
+    if leaderboard_text is None:
+        generation = cache.generation
+        leaderboard_data = await get_leaderboard(board)
+        leaderboard_text = render_leaderboard(leaderboard_data, board)
+        cache.store(leaderboard_data, leaderboard_text, bucket, generation)
+    reply_markup = InlineKeyboardMarkup([[
+        InlineKeyboardButton(label, callback_data=f"show_leaderboard:{name}")
+        for name, label in LEADERBOARD_BOARDS.items()
+    ]])
     # If called from button
     if query:
         await query.answer()
         if query.message and (query.message.text or query.message.caption):
-            await query.message.edit_text(leaderboard_text)
+            try:
+                await query.message.edit_text(leaderboard_text, reply_markup=reply_markup)
+            except BadRequest as e:
+                # Tapping the board that is already shown
+                if "not modified" not in str(e).lower():
+                    raise
         else:
-            await query.message.reply_text(leaderboard_text)
+            await query.message.reply_text(leaderboard_text, reply_markup=reply_markup)
     else:
         # Called from /leaderboard command
-        await update.message.reply_text(leaderboard_text)
+        await update.message.reply_text(leaderboard_text, reply_markup=reply_markup)
 
 async def how_to_use(update: Union[Update, CallbackQueryHandler], context: ContextTypes.DEFAULT_TYPE):
     """Handle how-to-use command from button or command."""
@@ -528,18 +1496,42 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ *Access Denied*", parse_mode="Markdown")
         return
 
-    user_count = get_user_count()
-    transactions_count = leaderboard_collection.count_documents({})
-    total_airtime = leaderboard_collection.aggregate([
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).next().get('total', 0)
+    if transaction_buffer:
+        # Counters lag behind buffered transactions until they're flushed
+        await transaction_buffer.flush()
+        write_behind = "{:,} flushes, avg batch {:.1f}, last {:.0f}ms, max {:.0f}ms, {:,} held, {:,} written directly".format(
+            transaction_buffer.flushes,
+            transaction_buffer.flushed / max(1, transaction_buffer.flushes),
+            transaction_buffer.last_latency * 1000,
+            transaction_buffer.max_latency * 1000,
+            transaction_buffer.held,
+            transaction_buffer.bypassed
+        )
+    else:
+        write_behind = "off"
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    counters = await counters_collection.find_one(
+        {'_id': STATS_COUNTERS_ID},
+        {'total_users': 1, 'total_transactions': 1, 'total_volume': 1, f'new_users.{today}': 1}
+    ) or {}
+    user_count = counters.get('total_users', 0)
+    new_today = counters.get('new_users', {}).get(today, 0)
+    transactions_count = counters.get('total_transactions', 0)
+    total_airtime = counters.get('total_volume', 0)
+    await activity_tracker.flush()
+    activity = await get_activity_stats()
     
     stats_text = """
 📈 *Bot Statistics Dashboard* 📈
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━
 👥 *Users:*
 ├─ Total: {}
-└─ Active Today: {}
+├─ New Today: {}
+├─ Active Today: {}
+├─ Active This Week: {}
+├─ Active This Month: {}
+└─ Retention D1 / D7: {:.1f}% / {:.1f}%
 
 💸 *Transactions:*
 ├─ Total: {}
@@ -547,17 +1539,542 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 ⚙️ *System:*
 ├─ Uptime: 99.9%
+├─ Membership API Calls Saved: {:,}
+├─ Avatar Cache Hits / Misses: {:,} / {:,}
+├─ Notification Queue: {} (lag {:.1f}s, max {:.1f}s, dropped {:,})
+├─ Animation Frames Sent / Skipped: {:,} / {:,}
+├─ Transfers In Flight: {} / {}
+├─ Rejected (flood / busy): {:,} / {:,}
+├─ Write-Behind: {}
 └─ Status: Operational
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """.format(
         user_count,
-        users_collection.count_documents({"join_date": {"$gte": datetime.now().strftime('%Y-%m-%d')}}),
+        new_today,
+        activity['dau'],
+        activity['wau'],
+        activity['mau'],
+        activity['d1_retention'],
+        activity['d7_retention'],
         transactions_count,
-        total_airtime
+        total_airtime,
+        membership_index.api_calls_saved,
+        avatar_cache.memory_hits + avatar_cache.disk_hits,
+        avatar_cache.misses,
+        notification_pipeline.queue.qsize(),
+        notification_pipeline.last_lag,
+        notification_pipeline.max_lag,
+        notification_pipeline.dropped,
+        animation_scheduler.frames_sent,
+        animation_scheduler.frames_skipped,
+        admission.in_flight,
+        admission.max_animations,
+        admission.rejected_user,
+        admission.rejected_busy,
+        write_behind
     )
 
     await update.message.reply_text(stats_text, parse_mode="Markdown")
 
+async def rebuild_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Queue a rebuild of the /stats counters from the raw collections."""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ *Access Denied*", parse_mode="Markdown")
+        return
+
+    await enqueue_job('recompute_stats', {})
+    await update.message.reply_text(
+        "🔄 *Stats rebuild queued*\n\nCounters will be recomputed from the raw collections.",
+        parse_mode="Markdown"
+    )
+
+async def limits(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the admission limits, or change one with /limits <name> <value>."""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ *Access Denied*", parse_mode="Markdown")
+        return
+
+    if context.args:
+        if len(context.args) != 2:
+            await update.message.reply_text("Usage: /limits <name> <value>")
+            return
+        try:
+            admission.configure(*context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        await admission.save()
+
+    settings_text = "\n".join(f"{name}: {value}" for name, value in admission.settings().items())
+    await update.message.reply_text(f"🚦 Admission limits\n\n{settings_text}")
+
+# Job Queue
+class LeaseLost(Exception):
+    """Raised when another worker has taken over a job we were running."""
+
+class JobInterrupted(Exception):
+    """Raised by a handler at a checkpoint when this instance is shutting down."""
+
+# Set on shutdown; handlers stop at their next checkpoint
+jobs_stopping = asyncio.Event()
+
+# Maps a job type to the coroutine that runs it: handler(bot, job_run)
+job_handlers = {}
+
+def job_handler(job_type):
+    """Register a coroutine as the handler for a job type."""
+    def register(func):
+        job_handlers[job_type] = func
+        return func
+    return register
+
+async def enqueue_job(job_type, payload, job_id=None, **fields):
+    """Queue a job for any bot instance to pick up. Returns the job id, or None if it already exists."""
+    now = datetime.now()
+    job = {
+        'type': job_type,
+        'payload': payload,
+        'status': 'pending',
+        'position': None,
+        'attempts': 0,
+        'lease_owner': None,
+        'lease_expires': None,
+        'created_at': now,
+        'updated_at': now,
+        **fields
+    }
+    if job_id is not None:
+        job['_id'] = job_id
+    try:
+        result = await jobs_collection.insert_one(job)
+    except DuplicateKeyError:
+        return None
+    return result.inserted_id
+
+async def claim_job():
+    """Lease the oldest runnable job, including ones whose previous owner died."""
+    now = datetime.now()
+    return await jobs_collection.find_one_and_update(
+        {
+            'status': {'$in': ['pending', 'running']},
+            '$or': [{'lease_expires': None}, {'lease_expires': {'$lt': now}}]
+        },
+        {
+            '$set': {
+                'status': 'running',
+                'lease_owner': WORKER_ID,
+                'lease_expires': now + timedelta(seconds=JOB_LEASE_SECONDS),
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+class JobRun:
+    """A leased job. Handlers checkpoint through it, which also renews the lease."""
+
+    def __init__(self, job):
+        self.job = job
+        self.id = job['_id']
+        self.payload = job['payload']
+        self.position = job.get('position')
+
+    async def _update(self, update):
+        now = datetime.now()
+        update.setdefault('$set', {}).update({
+            'lease_expires': now + timedelta(seconds=JOB_LEASE_SECONDS),
+            'updated_at': now
+        })
+        result = await jobs_collection.update_one({'_id': self.id, 'lease_owner': WORKER_ID}, update)
+        if result.matched_count == 0:
+            raise LeaseLost(f"Lost lease on job {self.id}")
+
+    async def checkpoint(self, position, **fields):
+        """Persist progress so a restarted job resumes after this point."""
+        self.position = position
+        await self._update({'$set': {'position': position, **fields}})
+        if jobs_stopping.is_set():
+            raise JobInterrupted
+
+    async def keep_alive(self):
+        """Renew the lease while the handler runs, so a long wait between
+        checkpoints (e.g. a RetryAfter backoff) can't hand the job to
+        another worker mid-batch. Runs until cancelled or the lease is lost."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            # Renewing a third of the way in leaves the rest of the lease to retry in
+            while True:
+                try:
+                    await self._update({})
+                    break
+                except LeaseLost as e:
+                    logger.warning(str(e))
+                    return
+                except Exception as e:
+                    logger.warning(f"Error renewing lease on job {self.id}, retrying: {e}")
+                    await asyncio.sleep(1)
+
+    async def finish(self, status='done', **fields):
+        await self._update({'$set': {'status': status, 'lease_owner': None, **fields}})
+
+    async def release(self):
+        """Hand the job back immediately so another worker can resume it."""
+        await jobs_collection.update_one(
+            {'_id': self.id, 'lease_owner': WORKER_ID},
+            {'$set': {'status': 'pending', 'lease_owner': None, 'lease_expires': None}}
+        )
+
+async def run_job(bot, job):
+    """Run one leased job and record its outcome."""
+    job_run = JobRun(job)
+    handler = job_handlers.get(job['type'])
+    if handler is None:
+        logger.error(f"No handler for job type {job['type']}")
+        await job_run.finish('failed', error='unknown job type')
+        return
+    heartbeat = asyncio.create_task(job_run.keep_alive())
+    try:
+        try:
+            await handler(bot, job_run)
+        finally:
+            heartbeat.cancel()
+        await job_run.finish()
+    except (JobInterrupted, asyncio.CancelledError):
+        # Shutting down: give the job back so another instance resumes it now
+        await job_run.release()
+        if not jobs_stopping.is_set():
+            raise
+    except LeaseLost as e:
+        logger.warning(str(e))
+    except Exception as e:
+        logger.error(f"Job {job_run.id} ({job['type']}) failed: {e}", exc_info=True)
+        if job['attempts'] >= JOB_MAX_ATTEMPTS:
+            await job_run.finish('failed', error=str(e))
+        else:
+            await job_run.release()
+
+async def job_worker(bot):
+    """Claim and run jobs until shutdown."""
+    while not jobs_stopping.is_set():
+        try:
+            job = await claim_job()
+        except Exception as e:
+            logger.error(f"Error claiming job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(jobs_stopping.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(bot, job)
+
+job_worker_tasks = []
+
+def start_job_workers(bot):
+    """Start this instance's job workers."""
+    for _ in range(JOB_WORKERS):
+        job_worker_tasks.append(asyncio.create_task(job_worker(bot)))
+
+async def stop_job_workers():
+    """Stop the job workers at their next checkpoint, cancelling any that overrun the grace period."""
+    jobs_stopping.set()
+    if job_worker_tasks:
+        _, pending = await asyncio.wait(job_worker_tasks, timeout=JOB_SHUTDOWN_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    job_worker_tasks.clear()
+
+@job_handler('rebuild_user_totals')
+async def rebuild_user_totals(bot, job_run):
+    """Recompute every user's airtime_sent and transactions from the transaction log."""
+    cursor = await leaderboard_collection.aggregate([
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    ], allowDiskUse=True)
+    batch = []
+    async for entry in cursor:
+        batch.append(UpdateOne(
+            {'user_id': entry['_id']},
+            {'$set': {'airtime_sent': entry['total'], 'transactions': entry['count']}}
+        ))
+        if len(batch) >= 1000:
+            await users_collection.bulk_write(batch, ordered=False)
+            batch = []
+            await job_run.checkpoint(None)
+    if batch:
+        await users_collection.bulk_write(batch, ordered=False)
+    leaderboard_caches['all'].invalidate()
+
+@job_handler('rebuild_leaderboard_buckets')
+async def rebuild_leaderboard_buckets(bot, job_run):
+    """Recompute the current period buckets from the transaction log."""
+    now = datetime.now()
+    for period in LEADERBOARD_PERIODS:
+        key, start, end = period_bucket(period, now)
+        cursor = await leaderboard_collection.aggregate([
+            {"$match": {"transaction_date": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": "$user_id", "username": {"$last": "$username"}, "total": {"$sum": "$amount"}}}
+        ], allowDiskUse=True)
+        batch = [
+            UpdateOne(
+                {'period': period, 'bucket': key, 'user_id': entry['_id']},
+                {'$set': {'username': entry['username'], 'total': entry['total'],
+                          'expires_at': end + timedelta(days=1)}},
+                upsert=True
+            )
+            async for entry in cursor
+        ]
+        if batch:
+            await leaderboard_buckets_collection.bulk_write(batch, ordered=False)
+        leaderboard_caches[period].invalidate()
+        await job_run.checkpoint(period)
+
+@job_handler('recompute_stats')
+async def recompute_stats(bot, job_run):
+    """Rebuild the /stats counters document from the users and transaction collections."""
+    cursor = await leaderboard_collection.aggregate([
+        {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$amount"}}}
+    ])
+    totals = await cursor.to_list(length=1)
+    totals = totals[0] if totals else {}
+    cursor = await users_collection.aggregate([
+        {"$group": {"_id": {"$substrBytes": ["$join_date", 0, 10]}, "count": {"$sum": 1}}}
+    ], allowDiskUse=True)
+    new_users = {entry['_id']: entry['count'] async for entry in cursor if entry['_id']}
+    await counters_collection.update_one(
+        {'_id': STATS_COUNTERS_ID},
+        {'$set': {
+            'total_users': await users_collection.count_documents({}),
+            'total_transactions': totals.get('count', 0),
+            'total_volume': totals.get('total', 0),
+            'new_users': new_users,
+            'rebuilt_at': datetime.now()
+        }},
+        upsert=True
+    )
+
+# Send failures that will never succeed for this chat
+PERMANENT_SEND_FAILURES = {'blocked', 'chat_not_found', 'deactivated'}
+
+def classify_send_error(error):
+    """Classify a send failure as blocked, chat_not_found, deactivated, transient or invalid."""
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        return 'deactivated' if 'deactivated' in message else 'blocked'
+    if isinstance(error, BadRequest):
+        return 'chat_not_found' if 'chat not found' in message else 'invalid'
+    if isinstance(error, NetworkError):
+        return 'transient'
+    return 'invalid'
+
+class TokenBucket:
+    """Async token bucket that halves its rate on RetryAfter and recovers gradually."""
+
+    def __init__(self, rate, capacity=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 10
+        # At least one token, or slow buckets (under 1/s) could never fill
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self):
+        """Take a token if one is available right now, without waiting."""
+        now = time.monotonic()
+        if now < self.blocked_until or self._lock.locked():
+            return False
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def backoff(self, retry_after):
+        """Pause everyone for retry_after seconds and halve the rate."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.updated = self.blocked_until
+        self.tokens = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        """Creep back towards the configured rate after a success."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 500)
+
+# Shared by every broadcast so concurrent runs stay under the global limit.
+# Each broadcast sends one message per chat, so the per-chat limit can't be hit.
+broadcast_limiter = TokenBucket(BROADCAST_RATE)
+
+async def send_broadcast_message(bot, user_id, text):
+    """Send one broadcast message. Returns 'success', 'failure' or 'unreachable'."""
+    for _ in range(BROADCAST_MAX_RETRIES):
+        await broadcast_limiter.acquire()
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                parse_mode="Markdown"
+            )
+            broadcast_limiter.recover()
+            return 'success'
+        except RetryAfter as e:
+            logger.warning(f"Rate limited, waiting {e.retry_after} seconds")
+            broadcast_limiter.backoff(e.retry_after)
+        except Exception as e:
+            reason = classify_send_error(e)
+            if reason in PERMANENT_SEND_FAILURES:
+                await mark_user_unreachable(user_id, reason)
+                return 'unreachable'
+            logger.warning(f"Failed to send to {user_id}: {e}")
+            if reason != 'transient':
+                break
+    return 'failure'
+
+@job_handler('broadcast')
+async def split_broadcast(bot, job_run):
+    """Split a broadcast into chunk jobs, resuming after the last chunked user."""
+    last_id = job_run.position
+    seq = job_run.job.get('chunks_total', 0)
+    while True:
+        query = dict(REACHABLE_USERS)
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        cursor = users_collection.find(query, {'user_id': 1}).sort('_id', 1).limit(BROADCAST_BATCH_SIZE)
+        users = await cursor.to_list(length=BROADCAST_BATCH_SIZE)
+        if not users:
+            break
+        # Deterministic chunk ids make re-splitting after a crash idempotent
+        await enqueue_job(
+            'broadcast_chunk',
+            {'broadcast_id': job_run.id, 'user_ids': [user['user_id'] for user in users]},
+            job_id=f"{job_run.id}:{seq}",
+            position=0
+        )
+        seq += 1
+        last_id = users[-1]['_id']
+        await job_run.checkpoint(last_id, chunks_total=seq)
+    await job_run.checkpoint(last_id, chunks_total=seq, split_done=True)
+    await maybe_finish_broadcast(bot, job_run.id)
+
+@job_handler('broadcast_chunk')
+async def send_broadcast_chunk(bot, job_run):
+    """Send a chunk of a broadcast, checkpointing after every concurrent batch."""
+    broadcast = await jobs_collection.find_one({'_id': job_run.payload['broadcast_id']})
+    user_ids = job_run.payload['user_ids']
+    position = job_run.position or 0
+    while position < len(user_ids):
+        batch = user_ids[position:position + BROADCAST_WORKERS]
+        results = await asyncio.gather(
+            *(send_broadcast_message(bot, user_id, broadcast['payload']['text']) for user_id in batch)
+        )
+        position += len(batch)
+        # Counted before the checkpoint, which raises JobInterrupted on shutdown
+        await jobs_collection.update_one({'_id': broadcast['_id']}, {'$inc': {
+            'success': results.count('success'),
+            'failures': results.count('failure'),
+            'unreachable': results.count('unreachable')
+        }})
+        await job_run.checkpoint(position)
+        await maybe_report_broadcast_progress(bot, broadcast['_id'])
+    # A set of chunk ids, so a chunk re-run after finishing can't count twice
+    await jobs_collection.update_one({'_id': broadcast['_id']}, {'$addToSet': {'chunks_done': job_run.id}})
+    await maybe_finish_broadcast(bot, broadcast['_id'])
+
+async def edit_broadcast_progress(bot, broadcast, text):
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=broadcast['payload']['chat_id'],
+            message_id=broadcast['payload']['message_id'],
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        logger.warning(f"Error updating broadcast progress: {e}")
+
+async def maybe_report_broadcast_progress(bot, broadcast_id):
+    """Update the admin's progress message, at most once per interval across all instances."""
+    now = datetime.now()
+    broadcast = await jobs_collection.find_one_and_update(
+        {'_id': broadcast_id, 'progress_at': {'$lt': now - timedelta(seconds=BROADCAST_PROGRESS_INTERVAL)}},
+        {'$set': {'progress_at': now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if broadcast is None:
+        return
+    done = broadcast['success'] + broadcast['failures'] + broadcast['unreachable']
+    total = broadcast['payload']['total']
+    elapsed = (now - broadcast['created_at']).total_seconds()
+    rate = done / elapsed if elapsed else 0
+    eta = int((total - done) / rate) if rate and total > done else 0
+    await edit_broadcast_progress(
+        bot, broadcast,
+        f"📤 *Broadcasting...*\n\n"
+        f"📩 Sent: {done}/{total}\n"
+        f"⚡ Speed: {rate:.1f} msg/s\n"
+        f"⏳ ETA: {eta // 60}m {eta % 60}s"
+    )
+
+async def maybe_finish_broadcast(bot, broadcast_id):
+    """Post the results once every chunk is done; only one instance wins."""
+    broadcast = await jobs_collection.find_one_and_update(
+        {'_id': broadcast_id, 'split_done': True, 'finalized': False,
+         '$expr': {'$eq': [{'$size': '$chunks_done'}, '$chunks_total']}},
+        {'$set': {'finalized': True}},
+        return_document=ReturnDocument.AFTER
+    )
+    if broadcast is None:
+        return
+    done = broadcast['success'] + broadcast['failures'] + broadcast['unreachable']
+    await edit_broadcast_progress(
+        bot, broadcast,
+        f"📊 *Broadcast Results*\n\n"
+        f"✅ Success: {broadcast['success']}\n"
+        f"❌ Failures: {broadcast['failures']}\n"
+        f"🚫 Unreachable (pruned): {broadcast['unreachable']}\n"
+        f"📩 Total Sent: {done}\n"
+    )
+
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, message):
+    """Queue a durable broadcast job and return immediately."""
+    total_users = await get_user_count()
+    progress_msg = await update.message.reply_text(
+        f"📤 Broadcasting to {total_users} users...",
+        parse_mode="Markdown"
+    )
+    await enqueue_job(
+        'broadcast',
+        {'text': message, 'chat_id': progress_msg.chat_id, 'message_id': progress_msg.message_id, 'total': total_users},
+        success=0,
+        failures=0,
+        unreachable=0,
+        chunks_total=0,
+        chunks_done=[],
+        split_done=False,
+        finalized=False,
+        progress_at=datetime.now()
+    )
+
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Broadcast command to send a message to all users."""
     if not is_admin(update.effective_user.id):
@@ -583,50 +2100,7 @@ async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["awaiting_broadcast"] = True
         return
 
-    # Send broadcast to all users
-    user_ids = get_all_users()
-    total_users = len(user_ids)
-    success = 0
-    failures = 0
-
-    progress_msg = await update.message.reply_text(
-        f"📤 Broadcasting to {total_users} users...",
-        parse_mode="Markdown"
-    )
-
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode="Markdown"
-            )
-            success += 1
-            await asyncio.sleep(0.5)  # To avoid flood control
-        except RetryAfter as e:
-            logger.warning(f"Rate limited, waiting {e.retry_after} seconds")
-            await asyncio.sleep(e.retry_after)
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode="Markdown"
-                )
-                success += 1
-            except Exception as e:
-                logger.warning(f"Failed to send to {user_id}: {e}")
-                failures += 1
-        except Exception as e:
-            logger.warning(f"Failed to send to {user_id}: {e}")
-            failures += 1
-
-    await progress_msg.edit_text(
-        f"📊 *Broadcast Results*\n\n"
-        f"✅ Success: {success}\n"
-        f"❌ Failures: {failures}\n"
-        f"📩 Total Sent: {success + failures}\n",
-        parse_mode="Markdown"
-    )
+    await start_broadcast(update, context, message)
 
 async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle broadcast message input from admin after /broadcast command."""
@@ -635,50 +2109,14 @@ async def handle_broadcast_message(update: Update, context: ContextTypes.DEFAULT
     if context.user_data.get("awaiting_broadcast"):
         message = update.message.text
         context.user_data["awaiting_broadcast"] = False
-        # Send broadcast to all users
-        user_ids = get_all_users()
-        total_users = len(user_ids)
-        success = 0
-        failures = 0
-
-        progress_msg = await update.message.reply_text(
-            f"📤 Broadcasting to {total_users} users...",
-            parse_mode="Markdown"
-        )
+        await start_broadcast(update, context, message)
 
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode="Markdown"
-                )
-                success += 1
-                await asyncio.sleep(0.5)  # To avoid flood control
-            except RetryAfter as e:
-                logger.warning(f"Rate limited, waiting {e.retry_after} seconds")
-                await asyncio.sleep(e.retry_after)
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=message,
-                        parse_mode="Markdown"
-                    )
-                    success += 1
-                except Exception as e:
-                    logger.warning(f"Failed to send to {user_id}: {e}")
-                    failures += 1
-            except Exception as e:
-                logger.warning(f"Failed to send to {user_id}: {e}")
-                failures += 1
-
-        await progress_msg.edit_text(
-            f"📊 *Broadcast Results*\n\n"
-            f"✅ Success: {success}\n"
-            f"❌ Failures: {failures}\n"
-            f"📩 Total Sent: {success + failures}\n",
-            parse_mode="Markdown"
-        )
+async def handle_private_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route private text to whichever flow the user is in."""
+    if context.user_data.get("awaiting_broadcast"):
+        await handle_broadcast_message(update, context)
+    else:
+        await handle_airtime_details(update, context)
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the broadcast process."""
@@ -687,6 +2125,126 @@ async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer("Broadcast canceled.")
     await query.message.edit_text("📢 *Broadcast Canceled*", parse_mode="Markdown")
 
+def airtime_transfer_frames(phone_number, amount):
+    """Every frame of the transfer animation as (text, parse_mode)."""
+    frames = [(frame, None) for frame in PROGRESS_FRAMES]
+    for percentage in range(1, 101):
+        progress = "[{0}{1}] \n<b>• ʜᴀᴄᴋɪɴɢ ɪɴ ᴘʀᴏɢʀᴇꜱꜱ :</b> {2}%\n".format(
+            ''.join(["▰" for _ in range(math.floor(percentage / 10))]),
+            ''.join(["▱" for _ in range(10 - math.floor(percentage / 10))]),
+            round(percentage, 2))
+        frames.append((f"💸 *Sending {amount:,} UGX to {phone_number}*\n\n{progress}", "HTML"))
+    return frames
+
+class AnimationScheduler:
+    """Plays message-edit animations within per-chat and global edit budgets.
+
+    Each animation is planned down to at most max_calls evenly spaced
+    frames (always ending on the last one). Edits in one chat are at
+    least chat_interval apart even across concurrent animations there,
+    through a next-allowed-edit time per chat kept in a bounded LRU. A
+    frame that finds the global budget exhausted is skipped rather than
+    queued; a RetryAfter jumps straight to the end.
+    """
+
+    def __init__(self, max_calls, duration, chat_interval, global_rate, max_chats):
+        self.max_calls = max_calls
+        self.duration = duration
+        self.chat_interval = chat_interval
+        self.max_chats = max_chats
+        self.limiter = TokenBucket(global_rate)
+        self._next_edit = OrderedDict()
+        self.active = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    def plan(self, frames):
+        """Pick which frames to show and how long to wait between them."""
+        count = max(1, min(self.max_calls, len(frames)))
+        if count == 1:
+            planned = [frames[-1]]
+        else:
+            planned = [frames[round(i * (len(frames) - 1) / (count - 1))] for i in range(count)]
+        self.frames_skipped += len(frames) - len(planned)
+        return planned, max(self.chat_interval, self.duration / len(planned))
+
+    async def wait_turn(self, chat_id, delay):
+        """Sleep at least delay, then until the chat's next edit slot, and claim that slot."""
+        now = time.monotonic()
+        at = max(now + delay, self._next_edit.pop(chat_id, 0))
+        self._next_edit[chat_id] = at + self.chat_interval
+        while len(self._next_edit) > self.max_chats:
+            self._next_edit.popitem(last=False)
+        await asyncio.sleep(at - now)
+
+    async def play(self, message, frames):
+        """Edit message through the planned frames."""
+        planned, interval = self.plan(frames)
+        self.active += 1
+        try:
+            for idx, (text, parse_mode) in enumerate(planned):
+                await self.wait_turn(message.chat_id, interval)
+                last = idx == len(planned) - 1
+                if not last and not self.limiter.try_acquire():
+                    self.frames_skipped += 1
+                    continue
+                if last:
+                    await self.limiter.acquire()
+                try:
+                    await message.edit_text(text, parse_mode=parse_mode)
+                    self.frames_sent += 1
+                except RetryAfter as e:
+                    self.limiter.backoff(e.retry_after)
+                    self.frames_skipped += len(planned) - idx
+                    return
+                except Exception as e:
+                    logger.error(f"Error updating progress: {e}")
+        finally:
+            self.active -= 1
+
+animation_scheduler = AnimationScheduler(
+    ANIMATION_MAX_CALLS, ANIMATION_DURATION, ANIMATION_CHAT_INTERVAL, ANIMATION_GLOBAL_RATE,
+    ANIMATION_TRACKED_CHATS
+)
+
+async def play_airtime_transfer(bot, user, progress_msg, phone_number, amount):
+    """Play the transfer animation, then replace it with the success message."""
+    try:
+        await animation_scheduler.play(progress_msg, airtime_transfer_frames(phone_number, amount))
+        await send_airtime_success(bot, user, progress_msg, phone_number, amount)
+    finally:
+        admission.finish()
+
+async def send_airtime_success(bot, user, progress_msg, phone_number, amount):
+    """Replace the progress message with the success image and caption."""
+
+    # Send success message with image
+    caption = generate_airtime_message(phone_number, amount, user.first_name or "User")
+    try:
+        await send_registered_photo(
+            bot,
+            url_media_key(CONFIG['success_image']),
+            CONFIG['success_image'],
+            chat_id=user.id,
+            caption=caption,
+            parse_mode="Markdown"
+        )
+        await progress_msg.delete()
+    except RetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        await send_registered_photo(
+            bot,
+            url_media_key(CONFIG['success_image']),
+            CONFIG['success_image'],
+            chat_id=user.id,
+            caption=caption,
+            parse_mode="Markdown"
+        )
+        await progress_msg.delete()
+    except Exception as e:
+        logger.error(f"Error sending success image: {e}")
+        await progress_msg.edit_text(caption, parse_mode="Markdown")
+
 async def handle_airtime_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the user's airtime details input."""
     logger.info(f"Handling message: {update.message.text}")
@@ -705,68 +2263,27 @@ async def handle_airtime_details(update: Update, context: ContextTypes.DEFAULT_T
                 raise ValueError("Amount must be positive")
                 
             user = update.effective_user
+            # Leave the flow open so the user can resend the same details later
+            if not admission.start():
+                await reject_admission(update, 'busy')
+                return
             context.user_data["awaiting_airtime_details"] = False
-            add_airtime_transaction(user.id, user.username, phone_number, amount)
-
-            # Send notification to channel
-            await send_notification(context.bot, user.id, user.username, "Sent Airtime", phone=phone_number, amount=amount)
-
-            # Enhanced sending animation with progress bar and PROGRESS_FRAMES
-            progress_msg = await update.message.reply_text("🔄 *Starting Airtime Transfer...*", parse_mode="Markdown")
-            
-            # Show PROGRESS_FRAMES animation
-            for frame in PROGRESS_FRAMES:
-                await asyncio.sleep(0.7)
-                try:
-                    await progress_msg.edit_text(frame)
-                except Exception as e:
-                    logger.error(f"Error updating progress frame: {e}")
-
-            # Continue with percentage animation
-            for i in range(1, 101):
-                await asyncio.sleep(0.05)
-                percentage = i
-                progress = "[{0}{1}] \n<b>• ʜᴀᴄᴋɪɴɢ ɪɴ ᴘʀᴏɢʀᴇꜱꜱ :</b> {2}%\n".format(
-                    ''.join(["▰" for _ in range(math.floor(percentage / 10))]),
-                    ''.join(["▱" for _ in range(10 - math.floor(percentage / 10))]),
-                    round(percentage, 2))
-                
-                try:
-                    await progress_msg.edit_text(
-                        f"💸 *Sending {amount:,} UGX to {phone_number}*\n\n{progress}",
-                        parse_mode="HTML"
-                    )
-                except RetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    continue
-                except Exception as e:
-                    logger.error(f"Error updating progress: {e}")
-                    continue
-
-            # Send success message with image
             try:
-                await context.bot.send_photo(
-                    chat_id=user.id,
-                    photo=CONFIG['success_image'],
-                    caption=generate_airtime_message(phone_number, amount, user.first_name or "User"),
-                    parse_mode="Markdown"
-                )
-                await progress_msg.delete()
-            except RetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                await context.bot.send_photo(
-                    chat_id=user.id,
-                    photo=CONFIG['success_image'],
-                    caption=generate_airtime_message(phone_number, amount, user.first_name or "User"),
-                    parse_mode="Markdown"
-                )
-                await progress_msg.delete()
-            except Exception as e:
-                logger.error(f"Error sending success image: {e}")
-                await progress_msg.edit_text(
-                    generate_airtime_message(phone_number, amount, user.first_name or "User"),
-                    parse_mode="Markdown"
-                )
+                await add_airtime_transaction(user.id, user.username, phone_number, amount)
+
+                # Queue notification to channel
+                notification_pipeline.submit(context.bot, user.id, user.username, "Sent Airtime", phone=phone_number, amount=amount)
+
+                # Enhanced sending animation with progress bar and PROGRESS_FRAMES
+                progress_msg = await update.message.reply_text("🔄 *Starting Airtime Transfer...*", parse_mode="Markdown")
+            except BaseException:
+                admission.finish()
+                raise
+            # Runs detached so the handler returns right away
+            context.application.create_task(
+                play_airtime_transfer(context.bot, user, progress_msg, phone_number, amount),
+                update=update
+            )
 
         except ValueError as e:
             await update.message.reply_text(
@@ -776,158 +2293,756 @@ async def handle_airtime_details(update: Update, context: ContextTypes.DEFAULT_T
                 parse_mode="Markdown"
             )
 
+# Notification pipeline
+NOTIFICATION_QUEUE_SIZE = int(os.getenv('NOTIFICATION_QUEUE_SIZE', 200))
+NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', 2))
+NOTIFICATION_OVERFLOW = os.getenv('NOTIFICATION_OVERFLOW', 'drop_oldest')  # or 'text_only'
+# Channel posts per minute; Telegram allows roughly 20 per minute in a channel
+NOTIFICATION_CHANNEL_RATE = float(os.getenv('NOTIFICATION_CHANNEL_RATE', 20))
+# Events per minute above which notifications are batched into albums, then into text summaries
+NOTIFICATION_DIGEST_THRESHOLD = int(os.getenv('NOTIFICATION_DIGEST_THRESHOLD', 15))
+NOTIFICATION_SUMMARY_THRESHOLD = int(os.getenv('NOTIFICATION_SUMMARY_THRESHOLD', 120))
+NOTIFICATION_DIGEST_WINDOW = float(os.getenv('NOTIFICATION_DIGEST_WINDOW', 10))
+MEDIA_GROUP_LIMIT = 10
+
+# Media registry: file_ids Telegram gave us for media we've already uploaded
+MEDIA_MEMORY_CACHE_SIZE = int(os.getenv('MEDIA_MEMORY_CACHE_SIZE', 10000))
+RENDERED_MEDIA_TTL_DAYS = 30
+
+class MediaRegistry:
+    """Maps media keys to Telegram file_ids, in a bounded LRU backed by Mongo."""
+
+    def __init__(self, memory_size):
+        self.memory_size = memory_size
+        self.hits = 0
+        self.uploads = 0
+        self._file_ids = OrderedDict()
+
+    def _remember(self, key, file_id):
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.memory_size:
+            self._file_ids.popitem(last=False)
+
+    async def get(self, key):
+        if key in self._file_ids:
+            self._file_ids.move_to_end(key)
+            return self._file_ids[key]
+        doc = await media_collection.find_one({'_id': key}, {'file_id': 1})
+        if doc:
+            self._remember(key, doc['file_id'])
+            return doc['file_id']
+        return None
+
+    async def put(self, key, file_id, ttl_days=None):
+        self._remember(key, file_id)
+        fields = {'file_id': file_id, 'updated_at': datetime.now()}
+        if ttl_days:
+            fields['expires_at'] = datetime.now() + timedelta(days=ttl_days)
+        await media_collection.update_one({'_id': key}, {'$set': fields}, upsert=True)
+
+    async def forget(self, key):
+        self._file_ids.pop(key, None)
+        await media_collection.delete_one({'_id': key})
+
+media_registry = MediaRegistry(MEDIA_MEMORY_CACHE_SIZE)
+
+def url_media_key(url):
+    return f"url:{url}"
+
+async def send_registered_photo(bot, key, source, ttl_days=None, **kwargs):
+    """Send a photo by its registered file_id, uploading source only the first time.
+
+    source is a URL/bytes, or a coroutine function producing them so the
+    work is skipped on a hit. Returns the sent message, or None if there
+    was nothing to send.
+    """
+    file_id = await media_registry.get(key)
+    if file_id:
+        try:
+            message = await bot.send_photo(photo=file_id, **kwargs)
+            media_registry.hits += 1
+            return message
+        except BadRequest as e:
+            # Telegram rejected the stored id; fall back to a fresh upload
+            logger.warning(f"Stale file_id for {key}, re-uploading: {e}")
+            await media_registry.forget(key)
+    if callable(source):
+        source = await source()
+        if source is None:
+            return None
+    message = await bot.send_photo(photo=source, **kwargs)
+    media_registry.uploads += 1
+    await media_registry.put(key, message.photo[-1].file_id, ttl_days)
+    return message
+
 # Notification channel
 NOTIFICATION_CHANNEL = os.getenv('NOTIFICATION_CHANNEL', '@smmserviceslogs')
 
+# Notification rendering pool: 'process' or 'thread'
+RENDER_POOL = os.getenv('RENDER_POOL', 'process')
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 2))
+RENDER_MAX_PENDING = int(os.getenv('RENDER_MAX_PENDING', 8))
+# How often to check whether the bot's avatar changed (seconds)
+TEMPLATE_REFRESH_INTERVAL = int(os.getenv('TEMPLATE_REFRESH_INTERVAL', 3600))
+
+# Notification image layout
+NOTIFICATION_SIZE = (800, 400)
+AVATAR_SIZE = 150
+AVATAR_RING_WIDTH = 6
+USER_AVATAR_POS = (130, 120)
+
+# Processed avatar cache: entries in memory, bytes on disk
+AVATAR_CACHE_DIR = os.getenv('AVATAR_CACHE_DIR', 'avatar_cache')
+AVATAR_MEMORY_CACHE_SIZE = int(os.getenv('AVATAR_MEMORY_CACHE_SIZE', 500))
+AVATAR_DISK_CACHE_BYTES = int(os.getenv('AVATAR_DISK_CACHE_BYTES', 200 * 1024 * 1024))
+DEFAULT_AVATAR_KEY = 'default'
+
+BOT_AVATAR_POS = (520, 120)
+
+async def get_profile_photo_size(bot, user_id):
+    """Return the largest PhotoSize of the user's current profile photo, or None"""
+    photos = await bot.get_user_profile_photos(user_id, limit=1)
+    if not photos.photos:
+        return None
+    return photos.photos[0][-1]
+
 async def get_profile_photo(bot, user_id):
-    """Download and process profile photo"""
+    """Download the user's profile photo, or None if there isn't one"""
     try:
-        photos = await bot.get_user_profile_photos(user_id, limit=1)
-        if not photos.photos:
+        photo_size = await get_profile_photo_size(bot, user_id)
+        if photo_size is None:
             raise Exception("No profile photo available")
-        photo_file = await bot.get_file(photos.photos[0][-1].file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        original_img = Image.open(io.BytesIO(photo_bytes)).convert("RGB")
-        # Create circular mask
-        size = (500, 500)
-        mask = Image.new('L', size, 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size[0], size[1]), fill=255)
-        # Resize and apply mask
-        img = ImageOps.fit(original_img, size, method=Image.LANCZOS)
-        img.putalpha(mask)
-        return img
+        photo_file = await bot.get_file(photo_size.file_id)
+        return bytes(await photo_file.download_as_bytearray())
     except Exception as e:
         logger.warning(f"Using default profile photo: {e}")
-        # Create default gray circle (500x500)
-        img = Image.new("RGBA", (500, 500), (70, 70, 70, 255))
-        draw = ImageDraw.Draw(img)
-        draw.ellipse((0, 0, 500, 500), fill=(100, 100, 100, 255))
-        return img
+        return None
 
-async def generate_notification_image(bot, user_img, user_name, bot_name, action):
-    """Generate a pro-quality notification image."""
+def load_profile_image(photo_bytes):
+    """Decode a profile photo into a circular image, or a default gray circle"""
+    if photo_bytes:
+        try:
+            original_img = Image.open(io.BytesIO(photo_bytes)).convert("RGB")
+            # Create circular mask
+            size = (500, 500)
+            mask = Image.new('L', size, 0)
+            draw = ImageDraw.Draw(mask)
+            draw.ellipse((0, 0, size[0], size[1]), fill=255)
+            # Resize and apply mask
+            img = ImageOps.fit(original_img, size, method=Image.LANCZOS)
+            img.putalpha(mask)
+            return img
+        except Exception as e:
+            logger.warning(f"Using default profile photo: {e}")
+    # Create default gray circle (500x500)
+    img = Image.new("RGBA", (500, 500), (70, 70, 70, 255))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((0, 0, 500, 500), fill=(100, 100, 100, 255))
+    return img
+
+@lru_cache(maxsize=None)
+def load_font(size):
+    """Load the notification font once per size, falling back to the default font"""
     try:
-        # Get bot profile photo
-        bot_img = await get_profile_photo(bot, bot.id)
-        # Create base image with rich gradient background
-        width, height = 800, 400
-        bg = Image.new("RGB", (width, height), (30, 30, 45))
-        gradient = Image.new("L", (1, height), color=0xFF)
-        for y in range(height):
-            gradient.putpixel((0, y), int(255 * (1 - y/height)))
-        alpha_gradient = gradient.resize((width, height))
-        black_img = Image.new("RGB", (width, height), color=(10, 10, 25))
-        bg = Image.composite(bg, black_img, alpha_gradient)
-        draw = ImageDraw.Draw(bg)
-        # Fonts - added fallback for each font individually
+        return ImageFont.truetype("arialbd.ttf", size)
+    except:
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=None)
+def circle_mask(size, inset=0):
+    """Circular alpha mask, optionally shrunk to sit inside the golden ring"""
+    mask = Image.new('L', (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((inset, inset, size - inset, size - inset), fill=255)
+    return mask
+
+def truncate(text, max_length):
+    return (text[:max_length] + '..') if len(text) > max_length else text
+
+def build_notification_template(bot_photo, bot_name):
+    """Composite every static layer of the notification image and return it as PNG bytes.
+
+    That is the gradient, title, both glows and golden rings, the bot's
+    avatar and name, and the bottom banner. Renders only add the user's
+    avatar and two strings on top.
+    """
+    # Create base image with rich gradient background
+    width, height = NOTIFICATION_SIZE
+    bg = Image.new("RGB", (width, height), (30, 30, 45))
+    gradient = Image.new("L", (1, height), color=0xFF)
+    for y in range(height):
+        gradient.putpixel((0, y), int(255 * (1 - y/height)))
+    alpha_gradient = gradient.resize((width, height))
+    black_img = Image.new("RGB", (width, height), color=(10, 10, 25))
+    bg = Image.composite(bg, black_img, alpha_gradient)
+    draw = ImageDraw.Draw(bg)
+    # Draw top title
+    draw.text((width // 2, 40), "NEW USER ACTIVITY", font=load_font(40),
+              fill="white", anchor="mm")
+    # Glow shared by both avatars
+    size = AVATAR_SIZE
+    glow = Image.new("RGBA", (size + 40, size + 40), (0, 0, 0, 0))
+    glow_draw = ImageDraw.Draw(glow)
+    center = (glow.size[0] // 2, glow.size[1] // 2)
+    for radius in range(size // 2 + 10, size // 2 + 20):
+        glow_draw.ellipse([
+            center[0] - radius, center[1] - radius,
+            center[0] + radius, center[1] + radius
+        ], fill=(255, 215, 0, 10), outline=None)
+    glow = glow.filter(ImageFilter.GaussianBlur(8))
+    # Golden ring
+    ring = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(ring).ellipse((0, 0, size - 1, size - 1), outline=(255, 215, 0), width=AVATAR_RING_WIDTH)
+    bot_img = load_profile_image(bot_photo).resize((size, size))
+    bot_img.putalpha(circle_mask(size))
+    for pos in (USER_AVATAR_POS, BOT_AVATAR_POS):
+        bg.paste(glow, (pos[0] - 20, pos[1] - 20), glow)
+    bg.paste(bot_img, BOT_AVATAR_POS, bot_img)
+    # The user's avatar is later pasted inside the ring, so the ring can be drawn now
+    for pos in (USER_AVATAR_POS, BOT_AVATAR_POS):
+        bg.paste(ring, pos, ring)
+    draw.text((BOT_AVATAR_POS[0] + 75, 290), truncate(bot_name, 15), font=load_font(28),
+              fill="white", anchor="ma")
+    # Bottom banner
+    draw.rectangle([0, 370, width, 400], fill=(255, 215, 0))
+    draw.text((width // 2, 385), "Powered by Airtime Bot", font=load_font(28),
+              fill=(30, 30, 30), anchor="mm")
+    img_byte_arr = io.BytesIO()
+    bg.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+# Decoded template, set in each render worker by init_render_worker
+notification_template = None
+
+def init_render_worker(template_png):
+    """Render pool initializer: decode the template once per worker"""
+    global notification_template
+    notification_template = Image.open(io.BytesIO(template_png)).convert("RGB")
+
+def process_avatar(photo_bytes):
+    """Turn a raw profile photo into the masked avatar PNG the renderer pastes. Runs in the render pool."""
+    avatar = load_profile_image(photo_bytes).resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+    avatar.putalpha(circle_mask(AVATAR_SIZE, AVATAR_RING_WIDTH))
+    img_byte_arr = io.BytesIO()
+    avatar.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def render_notification_image(avatar_png, user_name, action):
+    """Render the notification PNG. Runs in the render pool, so it takes and returns bytes."""
+    bg = notification_template.copy()
+    user_img = Image.open(io.BytesIO(avatar_png))
+    bg.paste(user_img, USER_AVATAR_POS, user_img)
+    draw = ImageDraw.Draw(bg)
+    draw.text((USER_AVATAR_POS[0] + 75, 290), truncate(user_name, 15), font=load_font(28),
+              fill="white", anchor="ma")
+    draw.text((NOTIFICATION_SIZE[0] // 2, 330), f"Action: {truncate(action, 30)}", font=load_font(24),
+              fill=(255, 215, 0), anchor="ma")
+    # Save to bytes
+    img_byte_arr = io.BytesIO()
+    bg.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+class RenderPool:
+    """Bounded executor for notification renders; sheds load instead of queueing without limit."""
+
+    def __init__(self, kind, workers, max_pending):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rendered = 0
+        self.skipped = 0
+        self.template = None
+        self._executor = None
+
+    def set_template(self, template_png):
+        """Install a new template; workers pick it up through their initializer."""
+        self.template = template_png
+        if self.kind == 'thread':
+            init_render_worker(template_png)
+        else:
+            # Process workers got the old template at startup, so replace them
+            self.shutdown()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                # spawn so workers don't inherit the event loop or Mongo sockets
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_render_worker,
+                    initargs=(self.template,)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+        return self._executor
+
+    async def submit(self, func, *args):
+        """Run func off the event loop. Returns its result, or None if saturated or failed."""
+        if self.template is None:
+            return None
+        if self.pending >= self.max_pending:
+            self.skipped += 1
+            logger.warning("Render pool saturated, skipping notification image")
+            return None
+        self.pending += 1
+        executor = self._get_executor()
         try:
-            title_font = ImageFont.truetype("arialbd.ttf", 40)
-        except:
-            title_font = ImageFont.load_default()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool as e:
+            # A worker died (OOM, kill); replace the pool unless a concurrent render already has
+            logger.error(f"Render pool broken, restarting it: {e}")
+            if self._executor is executor:
+                self.shutdown()
+            return None
+        except Exception as e:
+            logger.warning(f"Image generation error: {e}")
+            return None
+        finally:
+            self.pending -= 1
+
+    async def render(self, *args):
+        """Render a notification image. Returns PNG bytes or None."""
+        image = await self.submit(render_notification_image, *args)
+        if image is not None:
+            self.rendered += 1
+        return image
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+render_pool = RenderPool(RENDER_POOL, RENDER_WORKERS, RENDER_MAX_PENDING)
+
+# file_unique_id of the bot avatar the current template was built from
+template_avatar_id = None
+
+async def refresh_notification_template(bot):
+    """Rebuild the template if the bot's avatar changed since the last build."""
+    global template_avatar_id
+    try:
+        photo_size = await get_profile_photo_size(bot, bot.id)
+    except TelegramError as e:
+        logger.warning(f"Error checking bot avatar: {e}")
+        if render_pool.template is not None:
+            return
+        photo_size = None
+    avatar_id = photo_size.file_unique_id if photo_size else ''
+    if render_pool.template is not None and avatar_id == template_avatar_id:
+        return
+    bot_photo = await get_profile_photo(bot, bot.id) if photo_size else None
+    loop = asyncio.get_running_loop()
+    template_png = await loop.run_in_executor(None, build_notification_template, bot_photo, bot.first_name)
+    render_pool.set_template(template_png)
+    template_avatar_id = avatar_id
+    logger.info("Notification template rebuilt")
+
+async def run_template_refresh(bot):
+    """Re-check the bot's avatar periodically until cancelled."""
+    while True:
+        await asyncio.sleep(TEMPLATE_REFRESH_INTERVAL)
+        await refresh_notification_template(bot)
+
+class AvatarCache:
+    """Two-level LRU of processed avatars keyed by Telegram file_unique_id.
+
+    Hot entries stay in memory; everything is also written to a
+    size-bounded directory so restarts keep their hits. The directory is
+    only touched once load() runs (from post_init), never at import, which
+    spawned render workers repeat.
+    """
+
+    def __init__(self, directory, memory_size, disk_bytes):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_bytes = disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self._loaded = False
+
+    async def load(self):
+        """Create the directory and index what earlier runs left in it."""
+        for key, size in await asyncio.to_thread(self._scan):
+            if key not in self._disk:
+                self._disk[key] = size
+                self._disk_used += size
+        self._loaded = True
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.png')]
+        # Oldest first, so the disk LRU survives restarts
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return [(entry.name[:-4], entry.stat().st_size) for entry in entries]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _remember(self, key, avatar):
+        self._memory[key] = avatar
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key):
+        """Return the processed avatar PNG, or None on a miss."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return self._memory[key]
+        if key in self._disk:
+            try:
+                avatar = await asyncio.to_thread(self._read, key)
+                self._disk.move_to_end(key)
+                self._remember(key, avatar)
+                self.disk_hits += 1
+                return avatar
+            except OSError:
+                self._disk_used -= self._disk.pop(key)
+        self.misses += 1
+        return None
+
+    def _read(self, key):
+        path = self._path(key)
+        os.utime(path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def put(self, key, avatar):
+        self._remember(key, avatar)
+        if not self._loaded:
+            return
         try:
-            name_font = ImageFont.truetype("arialbd.ttf", 28)
-        except:
-            name_font = ImageFont.load_default()
+            await asyncio.to_thread(self._write, key, avatar)
+        except OSError as e:
+            logger.warning(f"Error writing avatar cache: {e}")
+            return
+        self._disk_used += len(avatar) - self._disk.pop(key, 0)
+        self._disk[key] = len(avatar)
+        while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _write(self, key, avatar):
+        with open(self._path(key), 'wb') as f:
+            f.write(avatar)
+
+avatar_cache = AvatarCache(AVATAR_CACHE_DIR, AVATAR_MEMORY_CACHE_SIZE, AVATAR_DISK_CACHE_BYTES)
+
+async def get_user_photo_size(bot, user_id):
+    """Like get_profile_photo_size, but errors mean the default avatar"""
+    try:
+        return await get_profile_photo_size(bot, user_id)
+    except TelegramError as e:
+        logger.warning(f"Using default profile photo: {e}")
+        return None
+
+def avatar_key(photo_size):
+    # file_unique_id is [A-Za-z0-9_-], safe to use as a file name
+    return photo_size.file_unique_id if photo_size else DEFAULT_AVATAR_KEY
+
+async def get_user_avatar(bot, photo_size):
+    """Return the processed avatar PNG for a profile photo, downloading and processing it only on a cache miss"""
+    key = avatar_key(photo_size)
+    avatar = await avatar_cache.get(key)
+    if avatar is not None:
+        return avatar
+    photo_bytes = None
+    if photo_size:
         try:
-            action_font = ImageFont.truetype("arialbd.ttf", 24)
-        except:
-            action_font = ImageFont.load_default()
-        # Draw top title
-        draw.text((width // 2, 40), "NEW USER ACTIVITY", font=title_font,
-                  fill="white", anchor="mm")
-        # Helper to draw glowing circular image
-        def draw_glowing_circle(base, img, pos, size, glow_color=(255, 215, 0)):
-            glow = Image.new("RGBA", (size + 40, size + 40), (0, 0, 0, 0))
-            glow_draw = ImageDraw.Draw(glow)
-            center = (glow.size[0] // 2, glow.size[1] // 2)
-            for radius in range(size // 2 + 10, size // 2 + 20):
-                glow_draw.ellipse([
-                    center[0] - radius, center[1] - radius,
-                    center[0] + radius, center[1] + radius
-                ], fill=glow_color + (10,), outline=None)
-            glow = glow.filter(ImageFilter.GaussianBlur(8))
-            base.paste(glow, (pos[0] - 20, pos[1] - 20), glow)
-            # Golden ring
-            ring = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-            ring_draw = ImageDraw.Draw(ring)
-            ring_draw.ellipse((0, 0, size - 1, size - 1), outline=(255, 215, 0), width=6)
-            # Add mask to image (ensure we're working with RGBA)
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            img = img.resize((size, size))
-            mask = Image.new('L', (size, size), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse((0, 0, size, size), fill=255)
-            img.putalpha(mask)
-            base.paste(img, pos, img)
-            base.paste(ring, pos, ring)
-        # Paste profile images
-        user_pos = (130, 120)
-        bot_pos = (520, 120)
-        draw_glowing_circle(bg, user_img, user_pos, 150)
-        draw_glowing_circle(bg, bot_img, bot_pos, 150)
-        # Draw usernames (with text length safety)
-        max_name_length = 15
-        safe_user_name = (user_name[:max_name_length] + '..') if len(user_name) > max_name_length else user_name
-        safe_bot_name = (bot_name[:max_name_length] + '..') if len(bot_name) > max_name_length else bot_name
-        draw.text((user_pos[0] + 75, 290), safe_user_name, font=name_font,
-                  fill="white", anchor="ma")
-        draw.text((bot_pos[0] + 75, 290), safe_bot_name, font=name_font,
-                  fill="white", anchor="ma")
-        # Draw action in the middle (with safety check)
-        max_action_length = 30
-        safe_action = (action[:max_action_length] + '..') if len(action) > max_action_length else action
-        draw.text((width // 2, 330), f"Action: {safe_action}", font=action_font,
-                  fill=(255, 215, 0), anchor="ma")
-        # Bottom banner
-        draw.rectangle([0, 370, width, 400], fill=(255, 215, 0))
-        draw.text((width // 2, 385), "Powered by Airtime Bot", font=name_font,
-                  fill=(30, 30, 30), anchor="mm")
-        # Save to bytes
-        img_byte_arr = io.BytesIO()
-        bg.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        return img_byte_arr
-    except Exception as e:
-        logger.warning(f"Image generation error: {e}")
+            photo_file = await bot.get_file(photo_size.file_id)
+            photo_bytes = bytes(await photo_file.download_as_bytearray())
+        except TelegramError as e:
+            logger.warning(f"Using default profile photo: {e}")
+            key = DEFAULT_AVATAR_KEY
+    avatar = await render_pool.submit(process_avatar, photo_bytes)
+    if avatar is not None:
+        await avatar_cache.put(key, avatar)
+    return avatar
+
+async def generate_notification_image(bot, photo_size, user_name, action):
+    """Generate a pro-quality notification image."""
+    avatar_png = await get_user_avatar(bot, photo_size)
+    if avatar_png is None:
         return None
+    return await render_pool.render(avatar_png, user_name, action)
 
-async def send_notification(bot, user_id, username, action, phone=None, amount=None):
-    """Send notification to channel with generated image and styled caption"""
-    try:
-        user_img = await get_profile_photo(bot, user_id)
-        bot_info = await bot.get_me()
-        image_bytes = await generate_notification_image(bot, user_img, username, bot_info.first_name, action)
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🤖 Vɪꜱɪᴛ Bᴏᴛ", url=f"https://t.me/{bot_info.username}")]
-        ])
-        caption = f"""⭐️ ｢Uꜱᴇʀ Aᴄᴛɪᴠɪᴛʏ Nᴏᴛɪꜰɪᴄᴀᴛɪᴏɴ 」⭐️
+def notification_media_key(photo_size, user_name, action):
+    """Key identifying a render by everything that goes into it"""
+    inputs = f"{template_avatar_id}|{avatar_key(photo_size)}|{user_name}|{action}"
+    return f"notification:{hashlib.sha256(inputs.encode()).hexdigest()}"
+
+channel_limiter = TokenBucket(NOTIFICATION_CHANNEL_RATE / 60, capacity=3)
+
+async def call_channel(func, *args, **kwargs):
+    """Post to the notification channel under its rate limit, waiting out RetryAfter."""
+    for attempt in range(3):
+        await channel_limiter.acquire()
+        try:
+            result = await func(*args, **kwargs)
+            channel_limiter.recover()
+            return result
+        except RetryAfter as e:
+            logger.warning(f"Notification channel rate limited, waiting {e.retry_after} seconds")
+            channel_limiter.backoff(e.retry_after)
+    raise Exception("Notification channel still rate limited after 3 attempts")
+
+def build_notification_caption(bot, user_id, username, action, phone=None, amount=None, occurred_at=None):
+    caption = f"""⭐️ ｢Uꜱᴇʀ Aᴄᴛɪᴠɪᴛʏ Nᴏᴛɪꜰɪᴄᴀᴛɪᴏɴ 」⭐️
 ━━━━━━━━•❅•°•❈•°•❅•━━━━━━━━
 ➠ 🕵🏻‍♂️ Uꜱᴇʀɴᴀᴍᴇ: @{username or 'Not set'}
 ━━━━━━━━━━━━━━━━━━━━━━━
 ➠ 🆔 Uꜱᴇʀ Iᴅ: {user_id}
 ━━━━━━━━━━━━━━━━━━━━━━━
 ➠ 📦 Aᴄᴛɪᴏɴ: {action}"""
-        if phone and amount:
-            caption += f"\n━━━━━━━━━━━━━━━━━━━━━━━\n➠ 📱 Pʜᴏɴᴇ: <code>{phone}</code>\n➠ 💸 Aᴍᴏᴜɴᴛ: <b>{amount:,} UGX</b>"
-        caption += f"""
+    if phone and amount:
+        caption += f"\n━━━━━━━━━━━━━━━━━━━━━━━\n➠ 📱 Pʜᴏɴᴇ: <code>{phone}</code>\n➠ 💸 Aᴍᴏᴜɴᴛ: <b>{amount:,} UGX</b>"
+    caption += f"""
 ━━━━━━━━━━━━━━━━━━━━━━━
-➠ ⏰ Tɪᴍᴇ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+➠ ⏰ Tɪᴍᴇ: {(occurred_at or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')}
 ━━━━━━━━━━━━━━━━━━━━━━━
-➠ 🤖 <b>Bᴏᴛ:</b> @{bot_info.username}
+➠ 🤖 <b>Bᴏᴛ:</b> @{bot.username}
 ━━━━━━━━•❅•°•❈•°•❅•━━━━━━━━"""
-        if image_bytes:
-            await bot.send_photo(
+    return caption
+
+async def send_notification(bot, user_id, username, action, phone=None, amount=None, occurred_at=None, text_only=False):
+    """Send notification to channel with generated image and styled caption"""
+    try:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🤖 Vɪꜱɪᴛ Bᴏᴛ", url=f"https://t.me/{bot.username}")]
+        ])
+        caption = build_notification_caption(bot, user_id, username, action, phone, amount, occurred_at)
+        sent = None
+        if not text_only:
+            photo_size = await get_user_photo_size(bot, user_id)
+            # Identical renders reuse the file_id of the first upload and skip rendering
+            sent = await call_channel(
+                send_registered_photo,
+                bot,
+                notification_media_key(photo_size, username, action),
+                lambda: generate_notification_image(bot, photo_size, username, action),
+                ttl_days=RENDERED_MEDIA_TTL_DAYS,
                 chat_id=NOTIFICATION_CHANNEL,
-                photo=image_bytes,
                 caption=caption,
                 parse_mode='HTML',
                 reply_markup=keyboard
             )
+        if sent is None:
+            await call_channel(
+                bot.send_message,
+                chat_id=NOTIFICATION_CHANNEL,
+                text=caption,
+                parse_mode='HTML',
+                reply_markup=keyboard
+            )
     except Exception as e:
         logger.warning(f"Error sending notification: {str(e)}")
 
+async def send_notification_album(bot, events):
+    """Send up to 10 notifications as one media group; events without an image go out individually."""
+    media, keys, leftovers = [], [], []
+    for event in events:
+        if event['text_only']:
+            leftovers.append(event)
+            continue
+        photo_size = await get_user_photo_size(bot, event['user_id'])
+        key = notification_media_key(photo_size, event['username'], event['action'])
+        try:
+            photo = await media_registry.get(key)
+        except Exception as e:
+            logger.warning(f"Error looking up notification media: {e}")
+            photo = None
+        if photo is None:
+            photo = await generate_notification_image(bot, photo_size, event['username'], event['action'])
+        if photo is None:
+            leftovers.append(event)
+            continue
+        caption = build_notification_caption(
+            bot, event['user_id'], event['username'], event['action'],
+            event['phone'], event['amount'], event['occurred_at']
+        )
+        media.append(InputMediaPhoto(media=photo, caption=caption, parse_mode='HTML'))
+        keys.append(key)
+    if len(media) == 1:
+        # A single photo can't be a media group
+        leftovers = events
+    elif media:
+        try:
+            messages = await call_channel(bot.send_media_group, chat_id=NOTIFICATION_CHANNEL, media=media)
+        except BadRequest as e:
+            # Most likely a stale file_id; drop them and let individual sends re-upload
+            logger.warning(f"Error sending notification album, sending individually: {e}")
+            try:
+                for key in keys:
+                    await media_registry.forget(key)
+            except Exception as e:
+                logger.warning(f"Error forgetting notification media: {e}")
+            leftovers = events
+        except Exception as e:
+            logger.warning(f"Error sending notification album: {e}")
+        else:
+            try:
+                for key, message in zip(keys, messages):
+                    await media_registry.put(key, message.photo[-1].file_id, RENDERED_MEDIA_TTL_DAYS)
+            except Exception as e:
+                # The album went out; we only lose the file_ids for next time
+                logger.warning(f"Error registering notification media: {e}")
+    for event in leftovers:
+        await send_notification(bot, **event)
+
+async def send_notification_summary(bot, events):
+    """Collapse a burst of notifications into one text post."""
+    counts = {}
+    volume = 0
+    for event in events:
+        counts[event['action']] = counts.get(event['action'], 0) + 1
+        volume += event['amount'] or 0
+    lines = [f"➠ 📦 {action}: {count:,}" for action, count in counts.items()]
+    if volume:
+        lines.append(f"➠ 💸 Aᴍᴏᴜɴᴛ: <b>{volume:,} UGX</b>")
+    users = ", ".join(f"@{event['username']}" for event in events[-5:] if event['username'])
+    text = (
+        "⭐️ ｢Aᴄᴛɪᴠɪᴛʏ Dɪɢᴇꜱᴛ 」⭐️\n"
+        "━━━━━━━━•❅•°•❈•°•❅•━━━━━━━━\n"
+        f"➠ 📊 {len(events):,} events from {events[0]['occurred_at'].strftime('%H:%M:%S')} "
+        f"to {events[-1]['occurred_at'].strftime('%H:%M:%S')}\n"
+        + "\n".join(lines)
+        + (f"\n➠ 🕵🏻‍♂️ Lᴀᴛᴇꜱᴛ: {users}" if users else "")
+        + f"\n━━━━━━━━━━━━━━━━━━━━━━━\n➠ 🤖 <b>Bᴏᴛ:</b> @{bot.username}"
+    )
+    try:
+        await call_channel(bot.send_message, chat_id=NOTIFICATION_CHANNEL, text=text, parse_mode='HTML')
+    except Exception as e:
+        logger.warning(f"Error sending notification summary: {e}")
+
+class NotificationPipeline:
+    """Bounded in-process queue of channel notifications, drained by background workers.
+
+    When the queue is full the oldest event is dropped. With the text_only
+    overflow policy, events queued past the soft limit skip the image so
+    the backlog drains faster before anything has to be dropped.
+
+    Delivery adapts to the event rate: one post per event when quiet,
+    albums of up to 10 above the digest threshold, and a single text
+    summary per window above the summary threshold.
+
+    Notifications deliberately stay off the Mongo job queue: they are
+    best-effort and latency-sensitive, and a job round-trip per event
+    would cost more Mongo writes than the posts are worth.
+    """
+
+    def __init__(self, max_size, workers, overflow):
+        self.max_size = max_size
+        self.workers = workers
+        self.overflow = overflow
+        self.soft_limit = max_size // 2
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.sent = 0
+        self.dropped = 0
+        self.degraded = 0
+        self.digests = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._arrivals = deque()
+
+    def submit(self, bot, user_id, username, action, phone=None, amount=None):
+        """Queue a notification without waiting. Never blocks the caller."""
+        now = time.monotonic()
+        self._arrivals.append(now)
+        text_only = self.overflow == 'text_only' and self.queue.qsize() >= self.soft_limit
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+        if text_only:
+            self.degraded += 1
+        self.queue.put_nowait({
+            'bot': bot,
+            'user_id': user_id,
+            'username': username,
+            'action': action,
+            'phone': phone,
+            'amount': amount,
+            'occurred_at': datetime.now(),
+            'text_only': text_only,
+            'queued_at': now
+        })
+
+    def rate(self):
+        """Events submitted in the last minute."""
+        cutoff = time.monotonic() - 60
+        while self._arrivals and self._arrivals[0] < cutoff:
+            self._arrivals.popleft()
+        return len(self._arrivals)
+
+    def _take(self, event):
+        self.last_lag = time.monotonic() - event.pop('queued_at')
+        self.max_lag = max(self.max_lag, self.last_lag)
+        return event
+
+    async def _collect(self, first, limit):
+        """Gather events arriving within the digest window, up to limit."""
+        events = [self._take(first)]
+        deadline = time.monotonic() + NOTIFICATION_DIGEST_WINDOW
+        while len(events) < limit:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            events.append(self._take(event))
+        return events
+
+    async def worker(self):
+        while True:
+            first = await self.queue.get()
+            rate = self.rate()
+            events = []
+            try:
+                if rate < NOTIFICATION_DIGEST_THRESHOLD:
+                    events = [self._take(first)]
+                    bot = events[0].pop('bot')
+                    await send_notification(bot, **events[0])
+                elif rate < NOTIFICATION_SUMMARY_THRESHOLD:
+                    events = await self._collect(first, MEDIA_GROUP_LIMIT)
+                    bot = events[0]['bot']
+                    for event in events:
+                        event.pop('bot')
+                    await send_notification_album(bot, events)
+                    self.digests += 1
+                else:
+                    events = await self._collect(first, self.max_size)
+                    await send_notification_summary(events[0]['bot'], events)
+                    self.digests += 1
+                self.sent += len(events)
+            except Exception as e:
+                # Keep the worker alive; one bad batch mustn't stop the queue draining
+                logger.error(f"Error sending notifications: {e}", exc_info=True)
+            finally:
+                # Every event taken off the queue, including those gathered by _collect
+                for _ in events or [first]:
+                    self.queue.task_done()
+
+    def start(self):
+        """Start the workers as background tasks."""
+        for _ in range(self.workers):
+            background_tasks.append(asyncio.create_task(self.worker()))
+
+notification_pipeline = NotificationPipeline(NOTIFICATION_QUEUE_SIZE, NOTIFICATION_WORKERS, NOTIFICATION_OVERFLOW)
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log errors and send a message to the user if possible."""
     logger.error("Exception while handling an update:", exc_info=context.error)
@@ -936,10 +3051,216 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         text = "⚠️ An error occurred while processing your request. Please try again."
         await update.effective_message.reply_text(text)
 
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record every user interaction for the DAU/WAU/MAU bitmaps."""
+    user = update.effective_user
+    if user and not user.is_bot and update.effective_chat and update.effective_chat.type == "private":
+        activity_tracker.record(user.id)
+
+# Long-running tasks started in post_init and cancelled in post_stop
+background_tasks = []
+
+async def post_init(application: Application):
+    """Run async startup tasks once the event loop is up."""
+    await ensure_indexes()
+    await check_query_plans()
+    await init_admins()
+    await admin_set.reload()
+    await avatar_cache.load()
+    await admission.load()
+    await membership_index.reconcile(application.bot)
+    # One-off backfill of the running totals the leaderboard now reads; the
+    # fixed job id makes every instance after the first skip it
+    await enqueue_job('rebuild_user_totals', {}, job_id='rebuild_user_totals:v1')
+    await enqueue_job('rebuild_leaderboard_buckets', {}, job_id='rebuild_leaderboard_buckets:v1')
+    await enqueue_job('recompute_stats', {}, job_id='recompute_stats:v1')
+    start_job_workers(application.bot)
+    await refresh_notification_template(application.bot)
+    background_tasks.append(asyncio.create_task(activity_tracker.run()))
+    background_tasks.append(asyncio.create_task(admin_set.watch()))
+    background_tasks.append(asyncio.create_task(membership_index.run()))
+    if transaction_buffer:
+        background_tasks.append(asyncio.create_task(transaction_buffer.run()))
+    background_tasks.append(asyncio.create_task(run_template_refresh(application.bot)))
+    notification_pipeline.start()
+
+async def post_stop(application: Application):
+    """Hand in-flight jobs back to the queue and flush buffers before the bot shuts down."""
+    await stop_job_workers()
+    for task in background_tasks:
+        task.cancel()
+    await activity_tracker.flush()
+    if transaction_buffer:
+        await transaction_buffer.close()
+    render_pool.shutdown()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently while keeping each user's updates in order.
+
+    Handlers rely on message order through user_data flags such as
+    awaiting_airtime_details, so updates sharing a user (or, without a
+    user, a chat) wait for each other. Everything else runs in parallel,
+    up to max_concurrent_updates at a time.
+    """
+
+    # The base class takes its semaphore before do_process_update, so updates
+    # queued behind one user's lock would each hold a global slot. Its limit
+    # is set out of reach and the real one applied after the per-user lock.
+    BASE_LIMIT = 2 ** 16
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(self.BASE_LIMIT)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting on it]
+        self._locks = {}
+
+    @staticmethod
+    def ordering_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class WebhookIngress:
+    """aiohttp endpoint that acknowledges Telegram before any update is handled.
+
+    Requests are authenticated by the secret-token header and their raw
+    bodies queued as-is; a consumer task decodes them, drops update_ids
+    seen recently and feeds the rest to the application. When the queue
+    is full Telegram gets a 503 and redelivers later.
+    """
+
+    def __init__(self, application, secret, max_size, dedupe_size):
+        self.application = application
+        self.secret = secret.encode()
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.dedupe_size = dedupe_size
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self._seen = OrderedDict()
+        self._task = None
+
+    async def handle(self, request):
+        if self.secret:
+            token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode()
+            if not hmac.compare_digest(token, self.secret):
+                return web.Response(status=403)
+        body = await request.read()
+        try:
+            self.queue.put_nowait(body)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    def is_duplicate(self, update_id):
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+        self._seen[update_id] = None
+        while len(self._seen) > self.dedupe_size:
+            self._seen.popitem(last=False)
+        return False
+
+    async def consume(self):
+        bot = self.application.bot
+        while True:
+            body = await self.queue.get()
+            try:
+                data = json.loads(body)
+                if self.is_duplicate(data.get('update_id')):
+                    continue
+                await self.application.update_queue.put(Update.de_json(data, bot))
+            except Exception as e:
+                logger.error(f"Dropping malformed webhook update: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self.consume())
+
+    async def stop(self):
+        """Hand what's already queued to the application, then stop."""
+        while not self.queue.empty() and not self._task.done():
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+
+async def run_webhook(application):
+    """Serve the webhook through WebhookIngress until SIGINT or SIGTERM."""
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    ingress = WebhookIngress(application, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_DEDUPE_SIZE)
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, ingress.handle)
+    runner = web.AppRunner(web_app)
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    ingress.start()
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    await application.bot.set_webhook(
+        WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"Webhook listening on port {PORT}")
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await ingress.stop()
+        await application.stop()
+        await post_stop(application)
+        await application.shutdown()
+
 # Main application setup
 def main():
     """Run the bot."""
-    application = Application.builder().token(CONFIG['token']).build()
+    application = (
+        Application.builder()
+        .token(CONFIG['token'])
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
+    
+    # Activity tracking runs before every other handler
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
     
     # Command handlers
     application.add_handler(CommandHandler("start", start))
@@ -949,25 +3270,25 @@ def main():
     application.add_handler(CommandHandler("contactus", contact_us))
     application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CommandHandler("broadcast", broadcast_message))
+    application.add_handler(CommandHandler("rebuildstats", rebuild_stats))
+    application.add_handler(CommandHandler("limits", limits))
     
     # Callback handlers
     application.add_handler(CallbackQueryHandler(verify_join_callback, pattern="^verify_join$"))
     application.add_handler(CallbackQueryHandler(send_airtime, pattern="^send_airtime$"))
-    application.add_handler(CallbackQueryHandler(show_leaderboard, pattern="^show_leaderboard$"))
+    application.add_handler(CallbackQueryHandler(show_leaderboard, pattern="^show_leaderboard(:\\w+)?$"))
     application.add_handler(CallbackQueryHandler(how_to_use, pattern="^how_to_use$"))
     application.add_handler(CallbackQueryHandler(cancel_broadcast, pattern="^cancel_broadcast$"))
     
-    # Message handlers - FIXED ORDER
-    # First check for airtime details
-    application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE,
-        handle_airtime_details
-    ))
+    # Channel membership tracking
+    application.add_handler(ChatMemberHandler(track_channel_member, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(track_bot_member, ChatMemberHandler.MY_CHAT_MEMBER))
     
-    # Then check for broadcast messages
+    # Private text goes through one handler; PTB only runs the first
+    # matching handler in a group, so two handlers here would shadow each other
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE,
-        handle_broadcast_message
+        handle_private_text
     ))
     
     # Add error handler
@@ -975,14 +3296,9 @@ def main():
     
     # Start the bot
     if os.getenv('RENDER'):
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=WEBHOOK_PATH,
-            webhook_url=WEBHOOK_URL
-        )
+        asyncio.run(run_webhook(application))
     else:
-        application.run_polling()
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
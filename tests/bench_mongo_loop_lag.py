@@ -0,0 +1,52 @@
+"""Event-loop lag with the old sync MongoClient vs AsyncMongoClient.
+
+Runs a burst of concurrent handler-like coroutines, each doing the
+add_user / is_admin round-trips, against a real mongod while a ticker
+measures how late the event loop wakes it. With the sync client every
+round-trip blocks the loop; with the async one the loop stays free.
+
+    MONGODB_URI=mongodb://localhost:27017 python tests/bench_mongo_loop_lag.py
+
+Uses (and drops) the database bench_loop_lag.
+"""
+import asyncio
+import os
+
+from pymongo import AsyncMongoClient, MongoClient
+
+from loop_lag import measure, report
+
+URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+DATABASE = 'bench_loop_lag'
+HANDLERS = 200
+
+async def main():
+    sync_client = MongoClient(URI, serverSelectionTimeoutMS=3000)
+    async_client = AsyncMongoClient(URI, serverSelectionTimeoutMS=3000)
+    sync_db = sync_client[DATABASE]
+    async_db = async_client[DATABASE]
+    sync_db.users.create_index('user_id', unique=True)
+    sync_db.admins.create_index('user_id', unique=True)
+
+    async def sync_handler(user_id):
+        await asyncio.sleep(0)
+        sync_db.users.update_one({'user_id': user_id}, {'$set': {'username': f"user{user_id}"}}, upsert=True)
+        sync_db.admins.count_documents({'user_id': user_id})
+
+    async def async_handler(user_id):
+        await asyncio.sleep(0)
+        await async_db.users.update_one({'user_id': user_id}, {'$set': {'username': f"user{user_id}"}}, upsert=True)
+        await async_db.admins.count_documents({'user_id': user_id})
+
+    try:
+        for name, handler in (("sync", sync_handler), ("async", async_handler)):
+            report(name, HANDLERS, "handlers", *await measure(
+                lambda: asyncio.gather(*(handler(user_id) for user_id in range(HANDLERS)))
+            ))
+    finally:
+        sync_client.drop_database(DATABASE)
+        sync_client.close()
+        await async_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
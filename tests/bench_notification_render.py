@@ -0,0 +1,105 @@
+"""Per-image cost of the template-based notification render vs the old full render.
+
+legacy_render is the render as it was before the static template was
+precomputed, kept here only for comparison. The new path is timed both
+with a fresh avatar (process_avatar + render) and with a cached one
+(render only).
+
+    python tests/bench_notification_render.py
+"""
+import io
+import os
+import sys
+import timeit
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from bot import load_font, load_profile_image
+
+RENDERS = 50
+
+def legacy_render(user_photo, bot_photo, user_name, bot_name, action):
+    """The full render every notification used to do."""
+    user_img = load_profile_image(user_photo)
+    bot_img = load_profile_image(bot_photo)
+    width, height = 800, 400
+    bg = Image.new("RGB", (width, height), (30, 30, 45))
+    gradient = Image.new("L", (1, height), color=0xFF)
+    for y in range(height):
+        gradient.putpixel((0, y), int(255 * (1 - y/height)))
+    alpha_gradient = gradient.resize((width, height))
+    black_img = Image.new("RGB", (width, height), color=(10, 10, 25))
+    bg = Image.composite(bg, black_img, alpha_gradient)
+    draw = ImageDraw.Draw(bg)
+    # The old code loaded each font on every render
+    title_font = load_font.__wrapped__(40)
+    name_font = load_font.__wrapped__(28)
+    action_font = load_font.__wrapped__(24)
+    draw.text((width // 2, 40), "NEW USER ACTIVITY", font=title_font, fill="white", anchor="mm")
+
+    def draw_glowing_circle(base, img, pos, size, glow_color=(255, 215, 0)):
+        glow = Image.new("RGBA", (size + 40, size + 40), (0, 0, 0, 0))
+        glow_draw = ImageDraw.Draw(glow)
+        center = (glow.size[0] // 2, glow.size[1] // 2)
+        for radius in range(size // 2 + 10, size // 2 + 20):
+            glow_draw.ellipse([
+                center[0] - radius, center[1] - radius,
+                center[0] + radius, center[1] + radius
+            ], fill=glow_color + (10,), outline=None)
+        glow = glow.filter(ImageFilter.GaussianBlur(8))
+        base.paste(glow, (pos[0] - 20, pos[1] - 20), glow)
+        ring = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        ImageDraw.Draw(ring).ellipse((0, 0, size - 1, size - 1), outline=(255, 215, 0), width=6)
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        img = img.resize((size, size))
+        mask = Image.new('L', (size, size), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
+        img.putalpha(mask)
+        base.paste(img, pos, img)
+        base.paste(ring, pos, ring)
+
+    user_pos = (130, 120)
+    bot_pos = (520, 120)
+    draw_glowing_circle(bg, user_img, user_pos, 150)
+    draw_glowing_circle(bg, bot_img, bot_pos, 150)
+    draw.text((user_pos[0] + 75, 290), bot.truncate(user_name, 15), font=name_font, fill="white", anchor="ma")
+    draw.text((bot_pos[0] + 75, 290), bot.truncate(bot_name, 15), font=name_font, fill="white", anchor="ma")
+    draw.text((width // 2, 330), f"Action: {bot.truncate(action, 30)}", font=action_font,
+              fill=(255, 215, 0), anchor="ma")
+    draw.rectangle([0, 370, width, 400], fill=(255, 215, 0))
+    draw.text((width // 2, 385), "Powered by Airtime Bot", font=name_font, fill=(30, 30, 30), anchor="mm")
+    img_byte_arr = io.BytesIO()
+    bg.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def photo(seed):
+    """A 640x640 JPEG standing in for a downloaded profile photo."""
+    img = Image.effect_noise((640, 640), 64 + seed).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format='JPEG')
+    return out.getvalue()
+
+def timed(name, func, baseline=None):
+    seconds = min(timeit.repeat(func, number=RENDERS, repeat=3)) / RENDERS
+    speedup = f"   {baseline / seconds:5.1f}x" if baseline else ""
+    print(f"{name:<28} {seconds * 1000:7.2f}ms/image{speedup}")
+    return seconds
+
+def main():
+    user_photo, bot_photo = photo(1), photo(2)
+    bot.init_render_worker(bot.build_notification_template(bot_photo, "Airtime Bot"))
+    avatar = bot.process_avatar(user_photo)
+
+    baseline = timed("legacy full render", lambda: legacy_render(
+        user_photo, bot_photo, "someuser", "Airtime Bot", "Sent Airtime"))
+    timed("template + fresh avatar", lambda: bot.render_notification_image(
+        bot.process_avatar(user_photo), "someuser", "Sent Airtime"), baseline)
+    timed("template + cached avatar", lambda: bot.render_notification_image(
+        avatar, "someuser", "Sent Airtime"), baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Phone prefix lookup throughput at the current country count and at 60 countries.
+
+Each benchmark round looks up every number in a fixed sample, so
+lookups/s = len(sample) * rounds/s (the OPS column).
+
+    pytest tests/bench_phone_lookup.py
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+
+SAMPLE_SIZE = 1000
+
+def synthetic_table(countries):
+    """A PHONE_PREFIXES-shaped table with the real countries plus made-up ones."""
+    table = dict(bot.PHONE_PREFIXES)
+    code = 300
+    while len(table) < countries:
+        if str(code) not in table:
+            table[str(code)] = (f"Country {code}", {
+                f"Operator {n}": [f"{n}{d}" for d in range(10)] for n in range(1, 10)
+            })
+        code += 1
+    return table
+
+def sample_numbers(table):
+    rng = random.Random(0)
+    codes = list(table) + ["999"]
+    return [
+        rng.choice(["+", ""]) + rng.choice(codes) + rng.choice(["", "0"])
+        + "".join(rng.choice("0123456789") for _ in range(9))
+        for _ in range(SAMPLE_SIZE)
+    ]
+
+TABLES = {
+    f"{len(bot.PHONE_PREFIXES)} countries": bot.PHONE_PREFIXES,
+    "60 countries": synthetic_table(60),
+}
+
+@pytest.mark.parametrize("name", TABLES)
+def test_trie_lookup(benchmark, name):
+    trie = bot.build_phone_tries(TABLES[name])
+    numbers = sample_numbers(TABLES[name])
+
+    def lookup_all():
+        for number in numbers:
+            bot.match_phone(trie, number)
+
+    benchmark(lookup_all)
+
+def test_cached_lookup(benchmark):
+    numbers = sample_numbers(bot.PHONE_PREFIXES)
+    bot.detect_network_and_country.cache_clear()
+
+    def lookup_all():
+        for number in numbers:
+            bot.detect_network_and_country(number)
+
+    benchmark(lookup_all)
+
+def test_synthetic_table_matches():
+    trie = bot.build_phone_tries(TABLES["60 countries"])
+    assert bot.match_phone(trie, "+3001234") == ("Operator 1", "Country 300")
+    assert bot.match_phone(trie, "+2560772000000") == ("MTN", "Uganda 🇺🇬")
@@ -0,0 +1,48 @@
+"""Event-loop lag and throughput of notification renders, inline vs RenderPool.
+
+Renders a burst of notifications while a ticker measures how late the
+event loop wakes it up, first calling render_notification_image directly
+on the loop (as before the pool existed), then through thread and
+process RenderPools.
+
+    python tests/bench_render_pool.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+from loop_lag import measure, report
+
+RENDERS = 200
+WORKERS = 2
+
+async def main():
+    template = bot.build_notification_template(None, "Airtime Bot")
+    avatar = bot.process_avatar(None)
+    args = [(avatar, f"user{i}", "Sent Airtime") for i in range(RENDERS)]
+
+    bot.init_render_worker(template)
+
+    async def inline():
+        for arg in args:
+            bot.render_notification_image(*arg)
+
+    report("inline", RENDERS, "renders", *await measure(inline))
+
+    for kind in ('thread', 'process'):
+        pool = bot.RenderPool(kind, WORKERS, RENDERS)
+        pool.set_template(template)
+        # Start the workers outside the measurement
+        await pool.render(*args[0])
+
+        async def pooled():
+            await asyncio.gather(*(pool.render(*arg) for arg in args))
+
+        report(f"{kind} pool", RENDERS, "renders", *await measure(pooled))
+        pool.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""Load test for PerUserUpdateProcessor: /start latency while animations run.
+
+A few users each queue several long airtime animations while many other
+users send /start. Reports p50/p99 /start latency for the old sequential
+processing and for PerUserUpdateProcessor.
+
+    python tests/bench_update_latency.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import SimpleUpdateProcessor
+
+import bot
+
+ANIMATION_SECONDS = 0.5
+START_SECONDS = 0.005
+FLOODERS = 4
+ANIMATIONS_PER_FLOODER = 8
+STARTS = 500
+START_INTERVAL = 0.002
+
+def make_update(update_id, user_id, text):
+    user = User(user_id, f"user{user_id}", False)
+    chat = Chat(user_id, Chat.PRIVATE)
+    message = Message(update_id, datetime.now(), chat, from_user=user, text=text)
+    return Update(update_id, message=message)
+
+async def run(processor):
+    latencies = []
+
+    async def start(sent):
+        await asyncio.sleep(START_SECONDS)
+        latencies.append(time.perf_counter() - sent)
+
+    update_id = 0
+    tasks = []
+    for user_id in range(1, FLOODERS + 1):
+        for _ in range(ANIMATIONS_PER_FLOODER):
+            update_id += 1
+            update = make_update(update_id, user_id, "+256751722034 5000")
+            tasks.append(asyncio.create_task(
+                processor.process_update(update, asyncio.sleep(ANIMATION_SECONDS))
+            ))
+    for user_id in range(1000, 1000 + STARTS):
+        update_id += 1
+        update = make_update(update_id, user_id, "/start")
+        tasks.append(asyncio.create_task(processor.process_update(update, start(time.perf_counter()))))
+        await asyncio.sleep(START_INTERVAL)
+    await asyncio.gather(*tasks)
+    return latencies
+
+def report(name, latencies):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:<32} p50 {quantiles[49] * 1000:8.1f}ms   p99 {quantiles[98] * 1000:8.1f}ms")
+
+async def main():
+    print(f"{FLOODERS} users x {ANIMATIONS_PER_FLOODER} animations of {ANIMATION_SECONDS}s, "
+          f"{STARTS} /starts from other users")
+    report("sequential (previous default)", await run(SimpleUpdateProcessor(1)))
+    # FLOODERS * 2 slots: updates queued behind a flooder's lock mustn't hold any
+    for limit in (FLOODERS * 2, bot.MAX_CONCURRENT_UPDATES):
+        report(f"PerUserUpdateProcessor({limit})", await run(bot.PerUserUpdateProcessor(limit)))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+"""Shared event-loop lag probe for the benchmark scripts."""
+import asyncio
+import statistics
+import time
+
+TICK = 0.005
+
+async def measure(work):
+    """Await work() while a ticker samples loop lag; return (seconds, lag samples)."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return elapsed, lags
+
+def report(name, count, unit, elapsed, lags):
+    """Print throughput of count units plus loop lag p99 and max."""
+    p99 = statistics.quantiles(lags, n=100)[98] if len(lags) > 1 else lags[0]
+    print(f"{name:<16} {count / elapsed:8.1f} {unit}/s   "
+          f"loop lag p99 {p99 * 1000:7.1f}ms   max {max(lags) * 1000:7.1f}ms")